@@ -0,0 +1,61 @@
+# Reports end-to-end throughput of a streamed run (python main.py -s) reading and writing plain, gzip, bz2 and
+# xz csvs through stdin and stdout, against the uncompressed path, on a synthetic register from
+# benchmarks.generate. Each codec's input is written at its default level, the output at each -l level.
+# Usage: python -m benchmarks.bench_compression [-n rows] [-l levels e.g. 1,6] [-b buffer size] [-c codecs]
+import getopt
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import compressed
+from benchmarks import generate
+
+
+def run(input_location, output_location, options):
+    with open(input_location, 'rb') as input_file, open(output_location, 'wb') as output_file:
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'main.py', '-s'] + options, stdin=input_file, stdout=output_file,
+                       stderr=subprocess.DEVNULL, check=True)
+        return time.perf_counter() - start
+
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'n:l:b:c:')
+    opts = dict(opts)
+    n_rows = int(opts.get('-n', 200000))
+    levels = [int(level) for level in opts.get('-l', '1,6').split(',')]
+    codecs = opts.get('-c', ','.join(compressed.CODECS)).split(',')
+    buffer_options = ['--buffer-size', opts['-b']] if '-b' in opts else []
+    temp_dir = tempfile.mkdtemp()
+    try:
+        plain_location = os.path.join(temp_dir, 'register.csv')
+        with open(plain_location, 'w', newline='') as csv_file:
+            generate.write(n_rows, csv_file)
+        output_location = os.path.join(temp_dir, 'results')
+        seconds = run(plain_location, output_location, buffer_options)
+        report('plain', None, os.path.getsize(plain_location), os.path.getsize(output_location), n_rows, seconds,
+               seconds)
+        for codec in codecs:
+            input_location = plain_location + '.' + codec
+            with open(plain_location, encoding='utf-8', newline='') as plain_file, \
+                    compressed.open_text(input_location, 'w', codec, newline='') as codec_file:
+                shutil.copyfileobj(plain_file, codec_file)
+            for level in levels:
+                codec_seconds = run(input_location, output_location,
+                                    ['--compress', codec, '--level', str(level)] + buffer_options)
+                report(codec, level, os.path.getsize(input_location), os.path.getsize(output_location), n_rows,
+                       codec_seconds, seconds)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def report(codec, level, input_bytes, output_bytes, n_rows, seconds, plain_seconds):
+    print('%-6s level %-4s in %8.1f MB out %8.1f MB %8.2f s %10.0f rows/s %6.2fx plain time' % (
+        codec, '-' if level is None else level, input_bytes / 1e6, output_bytes / 1e6, seconds, n_rows / seconds,
+        seconds / plain_seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# Compares data_processor.cast_row with the compiled decoder on data/test_data.csv scaled up by repetition.
+# Usage: python -m benchmarks.bench_decoder [-n rows] [-f csv] [-c config]
+import csv
+import getopt
+import itertools
+import sys
+import time
+import data_processor
+import methods
+import reader
+
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'n:f:c:')
+    opts = dict(opts)
+    n_rows = int(opts.get('-n', 1000000))
+    settings, type_dict = reader.get_data_settings(opts.get('-c', 'config/settings.config'))
+    with open(opts.get('-f', 'data/test_data.csv'), encoding='utf-8') as csv_file:
+        header, raw_data = reader.read_file(csv.reader(csv_file))
+    rows = list(itertools.islice(itertools.cycle(raw_data), n_rows))
+    type_selector, converters = reader.validate_data_format(settings, header)
+
+    start = time.perf_counter()
+    key_fails = {}
+    for row in rows:
+        data_processor.cast_row(row, header, converters, key_fails)
+    report('cast_row', n_rows, time.perf_counter() - start)
+
+    for name, columns in [('decoder', None), ('decoder (calculator columns)', methods.BATCH_KEYS)]:
+        start = time.perf_counter()
+        decode = data_processor.compile_decoder(header, settings, columns)
+        key_fails = {}
+        for row in rows:
+            decode(row, key_fails)
+        report(name, n_rows, time.perf_counter() - start)
+
+
+def report(name, n_rows, seconds):
+    print('%-30s %9d rows %8.2f s %12.0f rows/s' % (name, n_rows, seconds, n_rows / seconds))
+
+
+if __name__ == '__main__':
+    main()
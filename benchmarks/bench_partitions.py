@@ -0,0 +1,81 @@
+# Reports output rows per second of writing calculated surveys from a synthetic register from benchmarks.generate:
+# one csv through the earlier per-key membership check and csv.DictWriter, one csv through writer.write_rows, and
+# one csv per owner and per road_num through partitions.write_partitions with 1, 2 and 4 writer threads.
+# Usage: python -m benchmarks.bench_partitions [-n rows] [-c config] [-w 1,2,4]
+import csv
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import time
+import data_processor
+import methods
+import partitions
+import reader
+import writer
+from benchmarks import generate
+
+
+def dict_writer(surveys, out_header, location):
+    # write_rows as it was, a dict copy of each survey filtered by membership of the out_header list
+    with open(location, 'w', newline='') as out_file:
+        csv_writer = csv.DictWriter(out_file, fieldnames=out_header)
+        csv_writer.writeheader()
+        for s in surveys:
+            ws = {}
+            for k in s.keys():
+                if k in out_header:
+                    ws[k] = s[k]
+            csv_writer.writerow(ws)
+
+
+def projected(surveys, out_header, location):
+    with open(location, 'w', newline='') as out_file:
+        csv_writer = csv.writer(out_file)
+        csv_writer.writerow(out_header)
+        writer.write_rows(csv_writer, surveys, out_header)
+
+
+def rate(function, surveys, *args):
+    start = time.perf_counter()
+    function(surveys, *args)
+    return len(surveys) / (time.perf_counter() - start)
+
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'n:c:w:')
+    opts = dict(opts)
+    n_rows = int(opts.get('-n', 200000))
+    settings, type_dict = reader.get_data_settings(opts.get('-c', 'config/settings.config'))
+    params = {'a_method': 'limits', 'r_method': 'iri', 'data_params': settings}
+    decode = data_processor.compile_decoder(generate.HEADER, settings)
+    plan = methods.hvirCalculator().compile(params)
+    key_fails = {}
+    surveys = []
+    for row_num, row in enumerate(generate.generate(n_rows)):
+        survey = decode(row, key_fails)
+        try:
+            plan.method_logic(survey, row_num)
+        except Exception:
+            continue
+        surveys.append(survey)
+    out_header = generate.HEADER + methods.OUT_KEYS
+    directory = tempfile.mkdtemp()
+    try:
+        location = os.path.join(directory, 'out.csv')
+        print('%-24s %9.0f rows/s' % ('DictWriter', rate(dict_writer, surveys, out_header, location)))
+        print('%-24s %9.0f rows/s' % ('projection', rate(projected, surveys, out_header, location)))
+        for column in ('owner', 'road_num'):
+            for writers in opts.get('-w', '1,2,4').split(','):
+                partition_dir = os.path.join(directory, '%s_%s' % (column, writers))
+                partition_params = {'partition': column, 'partition_dir': partition_dir, 'writers': writers}
+                speed = rate(partitions.write_partitions, surveys, out_header, partition_params)
+                print('%-24s %9.0f rows/s  %s files' % ('%s, %s writers' % (column, writers), speed,
+                                                       len(os.listdir(partition_dir))))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# Reports scalar calls per second of hvirCalculator.method_logic and of a plan from hvirCalculator.compile, for
+# each a and r method, on surveys decoded from a synthetic register from benchmarks.generate. Rows that fail
+# count as calls.
+# Usage: python -m benchmarks.bench_plan [-n rows] [-c config]
+import getopt
+import sys
+import time
+import data_processor
+import methods
+import reader
+from benchmarks import generate
+
+
+def calls(method_logic, surveys):
+    # Best of three, each on fresh copies of the surveys as method_logic writes its results into them
+    best = None
+    for repeat in range(3):
+        copies = [dict(survey) for survey in surveys]
+        start = time.perf_counter()
+        for row_num, survey in enumerate(copies):
+            try:
+                method_logic(survey, row_num)
+            except Exception:
+                pass
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return len(surveys) / best
+
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'n:c:')
+    opts = dict(opts)
+    n_rows = int(opts.get('-n', 200000))
+    settings, type_dict = reader.get_data_settings(opts.get('-c', 'config/settings.config'))
+    decode = data_processor.compile_decoder(generate.HEADER, settings)
+    key_fails = {}
+    surveys = [decode(row, key_fails) for row in generate.generate(n_rows)]
+    for a_method in ('limits', 'avc'):
+        for r_method in ('iri', 'hati'):
+            params = {'a_method': a_method, 'r_method': r_method, 'data_params': settings}
+            calculator = methods.hvirCalculator()
+            method_logic = calls(lambda survey, row_num: calculator.method_logic(survey, params, row_num), surveys)
+            plan = calls(methods.hvirCalculator().compile(params).method_logic, surveys)
+            print('%-6s %-4s method_logic %9.0f calls/s  plan %9.0f calls/s  x%.2f' % (
+                a_method, r_method, method_logic, plan, plan / method_logic))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Reports resident memory per calculated survey held as dicts and as compact records on a synthetic register
+# built by repeating data/test_data.csv with unique ids and chainages.
+# Usage: python -m benchmarks.bench_records [-n rows] [-f csv] [-c config]
+import csv
+import getopt
+import io
+import itertools
+import multiprocessing
+import os
+import sys
+import data_processor
+import methods
+import reader
+import records
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def synthetic_rows(header, raw_data, n_rows):
+    id_index = header.index('unique_id')
+    chain_index = header.index('chain_start')
+    buffer = io.StringIO()
+    csv_writer = csv.writer(buffer)
+    for row_num, row in enumerate(itertools.islice(itertools.cycle(raw_data), n_rows)):
+        row = list(row)
+        row[id_index] = 'S%09d' % row_num
+        row[chain_index] = str(row_num / 100.0)
+        csv_writer.writerow(row)
+    buffer.seek(0)
+    return csv.reader(buffer)
+
+
+def measure(variant, n_rows, csv_location, config_file, results):
+    settings, type_dict = reader.get_data_settings(config_file)
+    with open(csv_location, encoding='utf-8') as csv_file:
+        header, raw_data = reader.read_file(csv.reader(csv_file))
+    params = {'a_method': 'limits', 'r_method': 'iri', 'data_params': settings}
+    record_type = records.make_record_type(settings, data_processor.SURVEY_FIELDS) if variant == 'compact' else None
+    decode = data_processor.compile_decoder(header, settings, record_type=record_type)
+    calculator = methods.hvirCalculator()
+    rows = synthetic_rows(header, raw_data, n_rows)
+    key_fails = {}
+    start_rss = rss_bytes()
+    surveys = [calculator.method_logic(decode(row, key_fails), params)[0] for row in rows]
+    results.put((variant, len(surveys), rss_bytes() - start_rss))
+
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'n:f:c:')
+    opts = dict(opts)
+    n_rows = int(opts.get('-n', 1000000))
+    results = multiprocessing.Queue()
+    for variant in ('dict', 'compact'):
+        process = multiprocessing.Process(target=measure, args=(variant, n_rows, opts.get('-f', 'data/test_data.csv'),
+                                                                opts.get('-c', 'config/settings.config'), results))
+        process.start()
+        variant, count, rss = results.get()
+        process.join()
+        print('%-8s %9d rows %9.1f MB %7.0f bytes/row' % (variant, count, rss / 1e6, rss / count))
+
+
+if __name__ == '__main__':
+    import logging
+    logging.disable(logging.WARNING)
+    main()
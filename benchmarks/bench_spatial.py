@@ -0,0 +1,57 @@
+# Reports the time to build a spatial index over a synthetic register from benchmarks.generate, and the latency
+# of bbox and nearest queries around random segments.
+# Usage: python -m benchmarks.bench_spatial [-n rows] [-q queries] [-k nearest]
+import getopt
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import spatial
+from benchmarks import generate
+
+
+def latencies(query, points):
+    seconds = []
+    for point in points:
+        start = time.perf_counter()
+        query(*point)
+        seconds.append(time.perf_counter() - start)
+    return sorted(seconds)
+
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'n:q:k:')
+    opts = dict(opts)
+    n_rows, n_queries, k = int(opts.get('-n', 1000000)), int(opts.get('-q', 200)), int(opts.get('-k', 10))
+    temp_dir = tempfile.mkdtemp()
+    try:
+        csv_location = os.path.join(temp_dir, 'register.csv')
+        with open(csv_location, 'w', newline='') as csv_file:
+            generate.write(n_rows, csv_file)
+        start = time.perf_counter()
+        index = spatial.build(csv_location, os.path.join(temp_dir, 'index'))
+        print('build %d segments %.2f s' % (len(index), time.perf_counter() - start))
+
+        index = spatial.SpatialIndex(os.path.join(temp_dir, 'index'))
+        coordinates = index.arrays['coordinates']
+        generator = random.Random(0)
+        points = [(float(coordinates[row, 0]) + generator.uniform(-0.02, 0.02),
+                   float(coordinates[row, 1]) + generator.uniform(-0.02, 0.02))
+                  for row in (generator.randrange(len(index)) for query in range(n_queries))]
+        report('bbox 0.1 degrees', latencies(lambda long, lat: index.bbox_ids(long - 0.05, lat - 0.05, long + 0.05,
+                                                                             lat + 0.05), points))
+        report('nearest %d' % k, latencies(lambda long, lat: index.nearest_ids(long, lat, k), points))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def report(name, seconds):
+    print('%-20s p50 %7.2f ms  p99 %7.2f ms  max %7.2f ms' % (
+        name, seconds[len(seconds) // 2] * 1000, seconds[min(len(seconds) - 1, int(len(seconds) * 0.99))] * 1000,
+        seconds[-1] * 1000))
+
+
+if __name__ == '__main__':
+    main()
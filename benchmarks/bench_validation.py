@@ -0,0 +1,61 @@
+# Reports the overhead of --validate on the cast and calculate stages, and the time to validate a column cache,
+# on a synthetic register from benchmarks.generate.
+# Usage: python -m benchmarks.bench_validation [-n rows] [-c config]
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import time
+import column_cache
+import data_processor
+import validation
+import reader
+from benchmarks import generate
+
+
+def run(rows, header, params):
+    stats = data_processor.new_stats()
+    start = time.perf_counter()
+    for survey in data_processor.iter_rows(rows, header, params, None, stats):
+        pass
+    return time.perf_counter() - start, stats
+
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'n:c:')
+    opts = dict(opts)
+    n_rows = int(opts.get('-n', 1000000))
+    settings, type_dict = reader.get_data_settings(opts.get('-c', 'config/settings.config'))
+    rows = list(generate.generate(n_rows))
+    header = generate.HEADER
+    params = {'a_method': 'limits', 'r_method': 'iri', 'data_params': settings}
+
+    # Best of three alternating runs, the difference is small next to the run to run noise
+    runs = [(run(rows, header, params)[0], run(rows, header, dict(params, validate=True))) for repeat in range(3)]
+    seconds = min(plain for plain, validated in runs)
+    validated_seconds, stats = min((validated for plain, validated in runs), key=lambda validated: validated[0])
+    report('cast + calculate', n_rows, seconds)
+    report('cast + validate + calculate', n_rows, validated_seconds)
+    print('validation overhead %+.1f%%, %d columns with values outside their domain' % (
+        (validated_seconds - seconds) / seconds * 100, len(stats['validation'])))
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        csv_location = os.path.join(temp_dir, 'register.csv')
+        with open(csv_location, 'w', newline='') as csv_file:
+            generate.write(n_rows, csv_file)
+        cache = column_cache.open_cache(os.path.join(temp_dir, 'cache'), csv_location, settings)
+        start = time.perf_counter()
+        column_cache.validate(cache, validation.Validator(settings, cache['meta']['header']))
+        report('validate column cache', n_rows, time.perf_counter() - start)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def report(name, n_rows, seconds):
+    print('%-30s %9d rows %8.2f s %12.0f rows/s' % (name, n_rows, seconds, n_rows / seconds))
+
+
+if __name__ == '__main__':
+    main()
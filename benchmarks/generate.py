@@ -0,0 +1,132 @@
+# Generates a synthetic asset register with the data/test_data.csv columns. Roads are split into sections of
+# 10 m segments that share most attributes, and the category, surface, marking and missing value rates are set
+# so every a, r and w fallback branch is exercised.
+# Usage: python -m benchmarks.generate -n rows [-o out.csv] [-s seed]
+import csv
+import getopt
+import random
+import sys
+
+HEADER = ['unique_id', 'owner', 'road_num', 'road_name', 'sect_num', 'sect_nam', 'dirctn', 'start_long',
+          'start_lat', 'end_long', 'end_lat', 'path', 'chain_start', 'chain_end', 'int_len', 'road_cat', 'cway',
+          'Form_width', 'seal_flag', 'Seal_width', 'seal_date', 'line_mark', 'num_lanes', 'frwd_lanes',
+          'cntr_lanes', 'lane_width', 'seal_shld', 'unseal_shld', 'avc', 'mass_lim', 'len_lim', 'hati', 'iri',
+          'iri_date', 'rutt', 'rut_date', 'cracking', 'crk_date', 'strength', 'str_date', 'textowp', 'textbwp',
+          'tex_date', 'vcg', 'pave_type', 'pave_date', 'speed_lim', 'traffic', 'perc_heavy', 'climate', 'subgrade',
+          'cost_maint', 'cost_asset', 'revn_asset']
+
+OWNERS = ['Australian Antarctic Territory', 'Shire of Carnarvon', 'Main Roads Western Australia',
+          'Department for Infrastructure and Transport', 'Transport for NSW', 'Department of Transport and Main Roads',
+          'Northern Territory Government', 'City of Greater Geraldton']
+ROAD_NAMES = ['Highway', 'Road', 'Track', 'Way', 'Drive', 'Street']
+PLACES = ['Outback', 'Strzelecki', 'Flinders Ranges', 'Birdsville', 'Tanami', 'Gibb River', 'Stuart', 'Barkly',
+          'Nullarbor', 'Plenty', 'Sandover', 'Savannah']
+ROAD_CATS = ['R0', 'R1', 'R2', 'R3', 'R4', 'R5']
+ROAD_CAT_WEIGHTS = [0.03, 0.07, 0.12, 0.23, 0.33, 0.22]
+# Share of sections with an empty road_cat, seal_flag or line_mark, so missing category rows and failures are timed
+MISSING_CATEGORY_RATE = 0.01
+
+
+def maybe(rnd, missing_rate, value):
+    return '' if rnd.random() < missing_rate else value
+
+
+def date(rnd, first_year, last_year):
+    return '%02d/%02d/%d' % (rnd.randint(1, 28), rnd.randint(1, 12), rnd.randint(first_year, last_year))
+
+
+def generate(n_rows, seed=0):
+    rnd = random.Random(seed)
+    row_num = 0
+    road_count = 0
+    while row_num < n_rows:
+        road_count += 1
+        owner = rnd.choice(OWNERS)
+        road_num = str(1000 + road_count)
+        road_name = 'The %s %s' % (rnd.choice(PLACES), rnd.choice(ROAD_NAMES))
+        road_cat = rnd.choices(ROAD_CATS, ROAD_CAT_WEIGHTS)[0]
+        long, lat = rnd.uniform(113, 153), rnd.uniform(-43, -11)
+        chain = 0.0
+        for sect_count in range(rnd.randint(1, 12)):
+            sealed = rnd.random() < (0.9 if road_cat in ('R1', 'R2', 'R3') else 0.65)
+            marked = sealed and rnd.random() < 0.7
+            seal_width = rnd.choice([5, 6, 7, 8, 9, 10, 12, 14]) if sealed else None
+            section = {
+                'sect_num': 'S%05dE%05d' % (road_count, sect_count),
+                'sect_nam': '%s - %s' % (rnd.choice(PLACES), rnd.choice(PLACES)),
+                'dirctn': rnd.choice(['Forward ', 'Reverse ']),
+                'road_cat': maybe(rnd, MISSING_CATEGORY_RATE, road_cat),
+                'cway': rnd.choice(['A', 'A', 'A', 'B', 'C']),
+                'Form_width': maybe(rnd, 0.05, str((seal_width or rnd.choice([6, 8, 10])) + 2)),
+                'seal_flag': maybe(rnd, MISSING_CATEGORY_RATE, 'Sealed' if sealed else 'Unsealed'),
+                'Seal_width': maybe(rnd, 0.1, str(seal_width)) if sealed else '',
+                'seal_date': maybe(rnd, 0.2, date(rnd, 1970, 2019)) if sealed else '',
+                'line_mark': maybe(rnd, MISSING_CATEGORY_RATE, 'Yes' if marked else 'No'),
+                'num_lanes': rnd.choice(['1', '2', '2', '2', '4']),
+                'lane_width': maybe(rnd, 0.15, rnd.choice(['3', '3.2', '3.4', '3.5', '3.7'])) if marked else '',
+                'seal_shld': maybe(rnd, 0.15, rnd.choice(['0', '0.5', '1', '1.5', '2.5'])) if marked else '',
+                'unseal_shld': rnd.choice(['0', '0.5', '1']),
+                'avc': maybe(rnd, 0.1, str(rnd.randint(1, 12))),
+                'mass_lim': maybe(rnd, 0.3, rnd.choice(['42.5', '68', '82', '86', '125'])),
+                'len_lim': maybe(rnd, 0.3, rnd.choice(['19', '26', '36.5', '53.5'])),
+                'vcg': maybe(rnd, 0.4, str(rnd.randint(0, 5))),
+                'pave_type': rnd.choice(['SS', 'SU', 'US', 'UU', 'C']),
+                'pave_date': maybe(rnd, 0.3, date(rnd, 1950, 2019)),
+                'speed_lim': rnd.choice(['40', '60', '80', '100', '110']),
+                'traffic': str(rnd.randint(10, 20000)),
+                'perc_heavy': str(rnd.randint(1, 40)),
+                'climate': rnd.choice(['CD', 'CW', 'HD', 'HW']),
+                'subgrade': rnd.choice(['S', 'M', 'C', 'X', 'R']),
+            }
+            iri = rnd.uniform(0.8, 8.0) if rnd.random() > 0.2 else None
+            hati = rnd.uniform(0.5, 6.0) if rnd.random() > 0.6 else None
+            survey_date = date(rnd, 2010, 2019)
+            for segment in range(rnd.randint(20, 2000)):
+                if row_num >= n_rows:
+                    return
+                next_long, next_lat = long + rnd.uniform(-1e-4, 1e-4), lat + rnd.uniform(-1e-4, 1e-4)
+                row = dict(section)
+                row.update({
+                    'unique_id': '%sU%08d' % (road_num, row_num),
+                    'owner': owner, 'road_num': road_num, 'road_name': road_name,
+                    'start_long': '%.7f' % long, 'start_lat': '%.8f' % lat,
+                    'end_long': '%.7f' % next_long, 'end_lat': '%.8f' % next_lat, 'path': '',
+                    'chain_start': '%.2f' % chain, 'chain_end': '%.2f' % (chain + 0.01), 'int_len': '0.01',
+                    'frwd_lanes': '1', 'cntr_lanes': '1',
+                    'hati': '' if hati is None else '%.2f' % max(0.0, hati + rnd.gauss(0, 0.3)),
+                    'iri': '' if iri is None else '%.2f' % max(0.0, iri + rnd.gauss(0, 0.4)),
+                    'iri_date': survey_date if iri is not None else '',
+                    'rutt': maybe(rnd, 0.2, '%.1f' % rnd.uniform(1, 15)), 'rut_date': survey_date,
+                    'cracking': str(rnd.randint(0, 20)), 'crk_date': survey_date,
+                    'strength': maybe(rnd, 0.3, str(rnd.randint(50, 300))), 'str_date': survey_date,
+                    'textowp': '%.2f' % rnd.uniform(0.3, 2), 'textbwp': '%.2f' % rnd.uniform(0.3, 2),
+                    'tex_date': survey_date,
+                    'cost_maint': maybe(rnd, 0.8, '%.0f' % rnd.uniform(100, 10000)),
+                    'cost_asset': maybe(rnd, 0.8, '%.0f' % rnd.uniform(1000, 100000)),
+                    'revn_asset': maybe(rnd, 0.9, '%.0f' % rnd.uniform(100, 10000)),
+                })
+                yield [row[key] for key in HEADER]
+                long, lat, chain = next_long, next_lat, chain + 0.01
+                row_num += 1
+
+
+def write(n_rows, out_file, seed=0):
+    csv_writer = csv.writer(out_file, lineterminator='\n')
+    csv_writer.writerow(HEADER)
+    csv_writer.writerows(generate(n_rows, seed))
+
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'n:o:s:')
+    opts = dict(opts)
+    n_rows = int(opts.get('-n', 10000))
+    seed = int(opts.get('-s', 0))
+    if '-o' in opts:
+        with open(opts['-o'], 'w', newline='', encoding='utf-8') as out_file:
+            write(n_rows, out_file, seed)
+    else:
+        write(n_rows, sys.stdout, seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# Simulates many concurrent callers of service.py, each sending batches of synthetic rows over its own
+# connection, and reports client side latency percentiles and throughput next to the service's /metrics.
+# Starts a service on a temporary unix socket unless --socket or --port point at a running one.
+# Usage: python -m benchmarks.load_test [-c callers] [-n requests per caller] [-b rows per batch] [-o out.json]
+#                                       [--socket path | --port port]
+import concurrent.futures
+import csv
+import getopt
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import client
+from benchmarks import generate
+
+
+def make_batches(n_batches, batch_rows):
+    rows = generate.generate(n_batches * batch_rows)
+    batches = []
+    for n in range(n_batches):
+        out = io.StringIO()
+        csv_writer = csv.writer(out, lineterminator='\n')
+        csv_writer.writerow(generate.HEADER)
+        for row_num in range(batch_rows):
+            csv_writer.writerow(next(rows))
+        batches.append(out.getvalue())
+    return batches
+
+
+def caller(connect, batches):
+    # One caller, sending its batches one after another and timing each response
+    service = connect()
+    latencies = []
+    try:
+        for body in batches:
+            start = time.perf_counter()
+            service.calculate(body)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        service.close()
+    return latencies
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run_load(connect, callers, requests, batch_rows):
+    batches = make_batches(requests, batch_rows)
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(callers) as pool:
+        results = list(pool.map(lambda n: caller(connect, batches), range(callers)))
+    seconds = time.perf_counter() - start
+    latencies = sorted(latency for result in results for latency in result)
+    service = connect()
+    try:
+        metrics = service.metrics()
+    finally:
+        service.close()
+    report = {'callers': callers, 'requests': len(latencies), 'rows_per_request': batch_rows,
+              'seconds': round(seconds, 3),
+              'requests_per_second': round(len(latencies) / seconds, 1),
+              'rows_per_second': round(len(latencies) * batch_rows / seconds, 1),
+              'latency_ms': {name: round(percentile(latencies, q) * 1000, 3)
+                             for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.0))},
+              'service_metrics': metrics}
+    print('%d callers x %d requests of %d rows: %.1f requests/s, %.0f rows/s, latency p50 %.1f ms, p99 %.1f ms' % (
+        callers, requests, batch_rows, report['requests_per_second'], report['rows_per_second'],
+        report['latency_ms']['p50'], report['latency_ms']['p99']))
+    return report
+
+
+def start_service(socket_path):
+    process = subprocess.Popen([sys.executable, 'service.py', '--socket', socket_path],
+                               stderr=subprocess.DEVNULL)
+    for attempt in range(100):
+        if os.path.exists(socket_path):
+            return process
+        time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('service did not start on %s' % socket_path)
+
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'c:n:b:o:', ['socket=', 'port='])
+    opts = dict(opts)
+    callers, requests, batch_rows = int(opts.get('-c', 32)), int(opts.get('-n', 20)), int(opts.get('-b', 100))
+    process = None
+    if '--port' in opts:
+        def connect():
+            return client.Client(port=opts['--port'])
+    else:
+        socket_path = opts.get('--socket')
+        if socket_path is None:
+            socket_path = os.path.join(tempfile.mkdtemp(), 'hvir.sock')
+            process = start_service(socket_path)
+
+        def connect():
+            return client.Client(socket_path)
+    try:
+        report = run_load(connect, callers, requests, batch_rows)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    if '-o' in opts:
+        with open(opts['-o'], 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
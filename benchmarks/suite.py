@@ -0,0 +1,140 @@
+# Times the parse, cast, calculation and write stages on a synthetic register and saves the results as json.
+# Usage: python -m benchmarks.suite [-n rows] [-f csv] [-c config] [-o results.json] [-b baseline.json] [-t 0.1]
+# Without -f a register of -n rows is generated with benchmarks.generate. With -b each stage's rows/s is compared
+# against the baseline results and the exit code is 1 when any stage is slower by more than the -t fraction.
+import csv
+import datetime
+import getopt
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import data_processor
+import methods
+import reader
+import writer
+from benchmarks import generate
+
+
+class RssSampler:
+    # Samples the resident set size in a background thread for the duration of a with block
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self.start = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start = self.peak = rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def run_stage(results, name, stage, count):
+    # count is the number of rows the stage handles, or a function of the stage's return value giving it
+    with RssSampler() as sampler:
+        start = time.perf_counter()
+        value = stage()
+        seconds = time.perf_counter() - start
+    n_rows = count(value) if callable(count) else count
+    results[name] = {'rows': n_rows, 'seconds': round(seconds, 4), 'rows_per_second': round(n_rows / seconds, 1),
+                     'peak_rss_mb': round(sampler.peak / 1e6, 1),
+                     'rss_growth_mb': round((sampler.peak - sampler.start) / 1e6, 1)}
+    print('%-12s %9d rows %9.2f s %12.0f rows/s %9.1f MB peak RSS' % (name, n_rows, seconds, n_rows / seconds,
+                                                                      sampler.peak / 1e6))
+    return value
+
+
+def run_suite(csv_location, config_file):
+    params = {'a_method': 'limits', 'r_method': 'iri'}
+    params['data_params'], type_dict = reader.get_data_settings(config_file)
+    stages = {}
+    with open(csv_location, encoding='utf-8', newline='') as csv_file:
+        header, raw_data = run_stage(stages, 'parse', lambda: reader.read_file(csv.reader(csv_file)),
+                                     lambda value: len(value[1]))
+    n_rows = len(raw_data)
+    stats = data_processor.new_stats()
+    numbered = run_stage(stages, 'cast', lambda: list(data_processor.decode_rows(raw_data, header, params, stats)),
+                         n_rows)
+    del raw_data
+    surveys = run_stage(stages, 'calculation',
+                        lambda: list(data_processor.calculate_surveys(numbered, params, stats)), len(numbered))
+    del numbered
+    out_header = header + methods.OUT_KEYS
+    with tempfile.TemporaryFile('w', newline='') as out_file:
+        csv_writer = csv.writer(out_file)
+        run_stage(stages, 'write', lambda: writer.write_rows(csv_writer, surveys, out_header), len(surveys))
+    return {'meta': {'rows': n_rows, 'failed_rows': len(stats['failed_rows']), 'source': csv_location,
+                     'python': platform.python_version(), 'platform': platform.platform(),
+                     'commit': git_commit(), 'date': datetime.datetime.now().isoformat(timespec='seconds')},
+            'stages': stages}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    # Returns the stages whose rows/s dropped by more than threshold relative to the baseline
+    regressions = []
+    for name, stage in results['stages'].items():
+        if name not in baseline['stages']:
+            continue
+        before = baseline['stages'][name]['rows_per_second']
+        change = (stage['rows_per_second'] - before) / before
+        flag = 'REGRESSION' if change < -threshold else ''
+        print('%-12s %12.0f -> %12.0f rows/s %+7.1f%% %s' % (name, before, stage['rows_per_second'], change * 100,
+                                                             flag))
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'n:f:c:o:b:t:')
+    opts = dict(opts)
+    if '-f' in opts:
+        results = run_suite(opts['-f'], opts.get('-c', 'config/settings.config'))
+    else:
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as csv_file:
+            generate.write(int(opts.get('-n', 100000)), csv_file)
+        try:
+            results = run_suite(csv_file.name, opts.get('-c', 'config/settings.config'))
+            results['meta']['source'] = 'benchmarks.generate -n %s' % opts.get('-n', 100000)
+        finally:
+            os.remove(csv_file.name)
+    if '-o' in opts:
+        with open(opts['-o'], 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+    if '-b' in opts:
+        with open(opts['-b']) as json_file:
+            baseline = json.load(json_file)
+        if compare(results, baseline, float(opts.get('-t', 0.1))):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
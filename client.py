@@ -0,0 +1,84 @@
+import getopt
+import http.client
+import json
+import socket
+import sys
+import urllib.parse
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class Client:
+    # Keeps one connection to a running service.py for any number of requests
+    def __init__(self, socket_path=None, host='127.0.0.1', port=8765, timeout=60):
+        if socket_path is not None:
+            self.connection = UnixHTTPConnection(socket_path, timeout=timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, int(port), timeout=timeout)
+
+    def request(self, method, path, body=None, content_type=None):
+        headers = {} if content_type is None else {'Content-Type': content_type}
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        payload = response.read()
+        if response.status != 200:
+            raise RuntimeError('%s %s: %s' % (response.status, response.reason, payload.decode('utf-8')))
+        return payload
+
+    def calculate(self, body, content_type='text/csv', a_method=None, r_method=None):
+        # body is csv text with a header row, or json lines for content_type application/x-ndjson
+        query = {key: value for key, value in (('a', a_method), ('r', r_method)) if value is not None}
+        path = '/calculate' + ('?' + urllib.parse.urlencode(query) if query else '')
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        return self.request('POST', path, body, content_type).decode('utf-8')
+
+    def calculate_surveys(self, surveys, a_method=None, r_method=None):
+        # surveys are dicts of column values, returns a dict of the results for each
+        body = ''.join(json.dumps(survey) + '\n' for survey in surveys)
+        response = self.calculate(body, 'application/x-ndjson', a_method, r_method)
+        return [json.loads(line) for line in response.splitlines()]
+
+    def metrics(self):
+        return json.loads(self.request('GET', '/metrics'))
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    # Sends the csv on stdin (or -f) to the service and writes the results to stdout, or prints the metrics
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'f:a:r:', ['socket=', 'host=', 'port=', 'metrics'])
+    except getopt.GetoptError:
+        print('Usage: python client.py [-f csv] [-a a_method] [-r r_method] [--socket path | --port port] '
+              '[--metrics]')
+        sys.exit(2)
+    opts = dict(opts)
+    client = Client(opts.get('--socket'), opts.get('--host', '127.0.0.1'), opts.get('--port', 8765))
+    try:
+        if '--metrics' in opts:
+            print(json.dumps(client.metrics(), indent=2))
+            return
+        if '-f' in opts:
+            with open(opts['-f'], encoding='utf-8') as csv_file:
+                body = csv_file.read()
+        else:
+            body = sys.stdin.read()
+        sys.stdout.write(client.calculate(body, a_method=opts.get('-a'), r_method=opts.get('-r')))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
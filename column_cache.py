@@ -0,0 +1,236 @@
+import datetime
+import hashlib
+import json
+import os
+import numpy as np
+import data_processor
+import methods
+import reader
+import validation
+
+# Bump when the on-disk layout changes so older caches are rebuilt
+CACHE_VERSION = 2
+CHUNK_ROWS = 65536
+
+
+def source_location(params):
+    # The csv a cache is built from, which has to be a file
+    if 'filepath' not in params:
+        raise ValueError('--cache needs the input as a file with -f, it can not cache stdin')
+    return params['filepath']
+
+
+def config_key(settings):
+    # The parts of the config that affect casting, tuning default_values or thresholds reuses the cache
+    return hashlib.sha256(json.dumps({'version': CACHE_VERSION, 'datatypes': settings['datatypes'],
+                                      'datetime_format': settings['datetime_format']},
+                                     sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def fingerprint(source, settings):
+    # Depends on the csv bytes and the config_key
+    digest = hashlib.sha256(config_key(settings).encode('utf-8'))
+    with open(source, 'rb') as csv_file:
+        for block in iter(lambda: csv_file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def open_cache(cache_dir, source, settings):
+    # Loads the cache for source, building or rebuilding it first when it is missing or stale. The csv is only
+    # hashed when its size or modification time differ from the cached ones.
+    meta_location = os.path.join(cache_dir, 'meta.json')
+    source_stat = os.stat(source)
+    if os.path.exists(meta_location):
+        with open(meta_location) as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('config') == config_key(settings):
+            if meta['size'] == source_stat.st_size and meta['mtime_ns'] == source_stat.st_mtime_ns:
+                return load(cache_dir)
+            key = fingerprint(source, settings)
+            if meta['fingerprint'] == key:
+                # Same bytes, e.g. a copied or touched file
+                meta['size'], meta['mtime_ns'] = source_stat.st_size, source_stat.st_mtime_ns
+                _write_meta(meta_location, meta)
+                return load(cache_dir)
+            build(source, settings, cache_dir, key, source_stat)
+            return load(cache_dir)
+    build(source, settings, cache_dir, fingerprint(source, settings), source_stat)
+    return load(cache_dir)
+
+
+def _write_meta(meta_location, meta):
+    with open(meta_location, 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+
+def build(source, settings, cache_dir, key, source_stat=None):
+    # Casts every row once and writes each column to <column>.npy: ints as int64 with a <column>.missing.npy
+    # mask, other numbers as float64 with NaN for missing values, and strings and datetimes as int32 codes into
+    # <column>.strings.npy. meta.json is written last.
+    csv_file, csv_reader = reader.load_csv(source)
+    header, rows = reader.iter_file(csv_reader, csv_file)
+    reader.validate_data_format(settings, header)
+    types = {name: settings['datatypes'][name]['type'] for name in header}
+    stats = data_processor.new_stats()
+    chunks = {name: [] for name in header + ['__row__']}
+    strings = {name: {} for name in header if types[name] in ('str', 'datetime')}
+    missing = {name: [] for name in header if types[name] == 'int'}
+    batch = []
+    for row_num, survey in data_processor.decode_rows(rows, header, {'data_params': settings}, stats):
+        batch.append((row_num, survey))
+        if len(batch) == CHUNK_ROWS:
+            _add_chunk(batch, header, chunks, strings, missing)
+            batch = []
+    _add_chunk(batch, header, chunks, strings, missing)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_location = os.path.join(cache_dir, 'meta.json')
+    if os.path.exists(meta_location):
+        os.remove(meta_location)
+    for name, arrays in chunks.items():
+        np.save(os.path.join(cache_dir, name + '.npy'), np.concatenate(arrays))
+    for name, masks in missing.items():
+        np.save(os.path.join(cache_dir, name + '.missing.npy'), np.concatenate(masks))
+    for name, codes in strings.items():
+        values = [value.isoformat() for value in codes] if types[name] == 'datetime' else list(codes)
+        np.save(os.path.join(cache_dir, name + '.strings.npy'), np.array(values or [''], dtype=str))
+    source_stat = source_stat or os.stat(source)
+    meta = {'fingerprint': key, 'config': config_key(settings), 'size': source_stat.st_size,
+            'mtime_ns': source_stat.st_mtime_ns, 'source': source, 'header': header, 'types': types,
+            'row_count': stats['row_count'], 'key_fails': stats['key_fails'], 'failed_rows': stats['failed_rows']}
+    _write_meta(meta_location, meta)
+
+
+def _add_chunk(batch, header, chunks, strings, missing):
+    chunks['__row__'].append(np.array([row_num for row_num, survey in batch], dtype=np.int64))
+    for name in header:
+        values = [survey.get(name) for row_num, survey in batch]
+        if name in strings:
+            codes = strings[name]
+            chunks[name].append(np.array([-1 if value is None else codes.setdefault(value, len(codes))
+                                          for value in values], dtype=np.int32))
+        elif name in missing:
+            chunks[name].append(np.array([0 if value is None else value for value in values], dtype=np.int64))
+            missing[name].append(np.array([value is None for value in values], dtype=bool))
+        else:
+            chunks[name].append(np.array([np.nan if value is None else value for value in values], dtype=float))
+
+
+def load(cache_dir):
+    with open(os.path.join(cache_dir, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    cache = {'meta': meta, 'columns': {}, 'strings': {}, 'missing': {}}
+    for name in meta['header'] + ['__row__']:
+        cache['columns'][name] = np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r')
+    for name in meta['header']:
+        if meta['types'][name] in ('str', 'datetime'):
+            cache['strings'][name] = np.load(os.path.join(cache_dir, name + '.strings.npy'), mmap_mode='r')
+        elif meta['types'][name] == 'int':
+            cache['missing'][name] = np.load(os.path.join(cache_dir, name + '.missing.npy'), mmap_mode='r')
+    return cache
+
+
+def numbers(cache, name, start=None, stop=None):
+    # A numeric column (or its start:stop rows) as float64 with NaN for missing values
+    values = np.asarray(cache['columns'][name][start:stop], dtype=float)
+    if name in cache['missing']:
+        values = np.where(cache['missing'][name][start:stop], np.nan, values)
+    return values
+
+
+def new_stats(cache):
+    # Statistics as if the rows had just been read and cast
+    stats = data_processor.new_stats()
+    stats['row_count'] = cache['meta']['row_count']
+    stats['key_fails'].update(cache['meta']['key_fails'])
+    stats['failed_rows'].extend(cache['meta']['failed_rows'])
+    return stats
+
+
+def iter_surveys(cache, record_type=None):
+    # Yields (row_num, survey) with the same surveys the row decoder produced when the cache was built
+    header = cache['meta']['header']
+    restore = {name: _restorer(cache, name) for name in header}
+    row_nums = cache['columns']['__row__']
+    for start in range(0, len(row_nums), CHUNK_ROWS):
+        stop = start + CHUNK_ROWS
+        values = [restore[name](start, stop) for name in header]
+        for row_num, cells in zip(row_nums[start:stop].tolist(), zip(*values)):
+            survey = dict.fromkeys(data_processor.SURVEY_FIELDS)
+            survey.update(zip(header, cells))
+            yield row_num, survey if record_type is None else record_type.from_dict(survey)
+
+
+def _restorer(cache, name):
+    datatype = cache['meta']['types'][name]
+    if datatype in ('str', 'datetime'):
+        table = cache['strings'][name].tolist()
+        if datatype == 'datetime':
+            table = [datetime.datetime.fromisoformat(value) for value in table]
+        table.append(None)  # code -1
+        return lambda start, stop: [table[code] for code in cache['columns'][name][start:stop].tolist()]
+    if datatype == 'int':
+        return lambda start, stop: [None if is_missing else value for value, is_missing in
+                                    zip(cache['columns'][name][start:stop].tolist(),
+                                        cache['missing'][name][start:stop].tolist())]
+    cast = {'float': float, 'bool': lambda value: bool(int(value))}[datatype]
+    return lambda start, stop: [None if value != value else cast(value)
+                                for value in cache['columns'][name][start:stop].tolist()]
+
+
+def validate(cache, validator):
+    # Checks the cached columns directly, strings and datetimes by their distinct values in the string tables
+    header = cache['meta']['header']
+    names = [name for name in header if name in validator.rules]
+    tables = {}
+    for name in names + ['unique_id']:
+        if name in cache['strings']:
+            table = cache['strings'][name].tolist()
+            if cache['meta']['types'][name] == 'datetime':
+                table = [datetime.datetime.fromisoformat(value) for value in table]
+            tables[name] = np.array(table + [None], dtype=object)  # code -1
+    row_nums = cache['columns']['__row__']
+    for start in range(0, len(row_nums), CHUNK_ROWS):
+        stop = start + CHUNK_ROWS
+        columns = {name: tables[name][cache['columns'][name][start:stop]] if name in tables
+                   else numbers(cache, name, start, stop) for name in names}
+        if 'unique_id' in tables:
+            ids = tables['unique_id'][cache['columns']['unique_id'][start:stop]].tolist()
+        else:
+            ids = row_nums[start:stop].tolist()
+        validator.check(columns, ids)
+    return validator.summary()
+
+
+def batch_columns(cache):
+    # Columns for hvirCalculator.method_logic_batch, straight from the cache without building surveys
+    columns = {}
+    n_rows = len(cache['columns']['__row__'])
+    for key, dtype in methods.BATCH_KEYS.items():
+        if key not in cache['columns']:
+            columns[key] = np.full(n_rows, np.nan) if dtype is float else np.full(n_rows, None, dtype=object)
+        elif key in cache['strings']:
+            table = np.array(cache['strings'][key].tolist() + [None], dtype=object)
+            columns[key] = table[cache['columns'][key]]
+        else:
+            columns[key] = numbers(cache, key)
+    return columns
+
+
+def run(params, stats=None):
+    # Runs the calculation from the column cache at params['column_cache'], built from params['filepath']
+    settings = params['data_params']
+    cache = open_cache(params['column_cache'], source_location(params), settings)
+    cached_stats = new_stats(cache)
+    if stats is not None:
+        stats.update(cached_stats)
+    else:
+        stats = cached_stats
+    if 'validate' in params:
+        stats['validation'] = validate(cache, validation.Validator(settings, cache['meta']['header']))
+    record_type = data_processor.get_record_type(params)
+    surveys = data_processor.calculate_surveys(iter_surveys(cache, record_type), params, stats)
+    if 'rollup' in params:
+        surveys = data_processor.rollup_surveys(surveys, stats)
+    return cache['meta']['header'], surveys, stats
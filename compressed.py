@@ -0,0 +1,137 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+
+# Codecs by name, with the file extensions that select them for output and the magic bytes that identify them
+# on input, whatever the file is called
+EXTENSIONS = {'.gz': 'gzip', '.gzip': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+MAGIC = {'gzip': b'\x1f\x8b', 'bz2': b'BZh', 'xz': b'\xfd7zXZ\x00'}
+CODECS = list(MAGIC)
+# gzip and xz as their command line tools, bz2's default is its best
+DEFAULT_LEVELS = {'gzip': 6, 'bz2': 9, 'xz': 6}
+LEVELS = {'gzip': range(0, 10), 'bz2': range(1, 10), 'xz': range(0, 10)}
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+def params_options(params):
+    # (codec, level, buffer_size) from the --compress, --level and --buffer-size options, None when not given
+    return (params.get('compress'), int(params['compress_level']) if 'compress_level' in params else None,
+            int(params['buffer_size']) if 'buffer_size' in params else None)
+
+
+def check_options(params):
+    # Raises a ValueError for a --compress codec or --level the codecs do not take, before any work is done
+    codec = params.get('compress')
+    if codec is not None and codec not in CODECS:
+        raise ValueError('Unknown compression %s, choose from %s' % (codec, ', '.join(CODECS)))
+    if 'compress_level' in params:
+        try:
+            level = int(params['compress_level'])
+        except ValueError:
+            raise ValueError('--level must be a number, not %s' % params['compress_level']) from None
+        # Without --compress the level is for the codec the outfile's name selects
+        codec = codec or codec_from_name(params.get('outfile', ''))
+        levels = LEVELS[codec] if codec is not None else range(0, 10)
+        if level not in levels:
+            raise ValueError('--level %s is outside the %s levels %s to %s' % (
+                level, codec or 'compression', levels[0], levels[-1]))
+    if 'buffer_size' in params and not params['buffer_size'].isdigit():
+        raise ValueError('--buffer-size must be a number of bytes, not %s' % params['buffer_size'])
+
+
+def codec_from_name(location):
+    # The codec a file name's last extension selects, None for any other name
+    return EXTENSIONS.get(os.path.splitext(location)[1].lower())
+
+
+def strip_extension(location):
+    # location without its compression extension, e.g. register.csv for register.csv.gz
+    return os.path.splitext(location)[0] if codec_from_name(location) else location
+
+
+def codec_from_bytes(head):
+    for codec, magic in MAGIC.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def detect(location):
+    # The codec of an existing file from its magic bytes, else from its name
+    if os.path.isfile(location):
+        with open(location, 'rb') as raw_file:
+            codec = codec_from_bytes(raw_file.read(6))
+        if codec is not None:
+            return codec
+    return codec_from_name(location)
+
+
+def _compressed_file(codec, raw_file, mode, level=None):
+    # A binary file object (de)compressing raw_file, which is left open when it is closed
+    if codec == 'gzip':
+        if mode == 'rb':
+            return gzip.GzipFile(fileobj=raw_file, mode=mode)
+        return gzip.GzipFile(fileobj=raw_file, mode=mode, mtime=0,
+                             compresslevel=DEFAULT_LEVELS[codec] if level is None else level)
+    if codec == 'bz2':
+        if mode == 'rb':
+            return bz2.BZ2File(raw_file, mode)
+        return bz2.BZ2File(raw_file, mode, compresslevel=DEFAULT_LEVELS[codec] if level is None else level)
+    if codec == 'xz':
+        if mode == 'rb':
+            return lzma.LZMAFile(raw_file, mode)
+        return lzma.LZMAFile(raw_file, mode, preset=DEFAULT_LEVELS[codec] if level is None else level)
+    raise ValueError('Unknown compression %s, choose from %s' % (codec, CODECS))
+
+
+class _ClosingWrapper(io.TextIOWrapper):
+    # A text file over a codec's file object that also closes the file underneath that
+    def __init__(self, buffer, raw_file, **kwargs):
+        super().__init__(buffer, **kwargs)
+        self._raw_file = raw_file
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self._raw_file is not None:
+                self._raw_file.close()
+
+
+def wrap_text(raw_file, codec, mode='r', level=None, buffer_size=None, encoding='utf-8', newline=None,
+              close_raw=False):
+    # Text read from or written to the binary raw_file through codec, e.g. sys.stdin.buffer
+    buffer_size = buffer_size or DEFAULT_BUFFER_SIZE
+    compressed_file = _compressed_file(codec, raw_file, mode + 'b', level)
+    if mode == 'r':
+        buffer = io.BufferedReader(compressed_file, buffer_size)
+    else:
+        buffer = io.BufferedWriter(compressed_file, buffer_size)
+    return _ClosingWrapper(buffer, raw_file if close_raw else None, encoding=encoding, newline=newline)
+
+
+def open_text(location, mode='r', codec=None, level=None, buffer_size=None, encoding='utf-8', newline=None):
+    # open() for plain or compressed text files. Reading detects the codec, writing takes it from the name
+    # unless codec is given.
+    if codec is None:
+        codec = detect(location) if mode == 'r' else codec_from_name(location)
+    if codec is None:
+        if buffer_size:
+            return open(location, mode, buffer_size, encoding=encoding, newline=newline)
+        return open(location, mode, encoding=encoding, newline=newline)
+    raw_file = open(location, mode + 'b', buffer_size or DEFAULT_BUFFER_SIZE)
+    try:
+        return wrap_text(raw_file, codec, mode, level, buffer_size, encoding, newline, close_raw=True)
+    except BaseException:
+        raw_file.close()
+        raise
+
+
+def read_stdin(stdin, buffer_size=None):
+    # stdin as it is, or decompressed when its first bytes are a codec's magic bytes
+    codec = codec_from_bytes(stdin.buffer.peek(6)[:6])
+    if codec is None:
+        return stdin
+    return wrap_text(stdin.buffer, codec, 'r', buffer_size=buffer_size)
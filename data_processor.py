@@ -1,31 +1,163 @@
+import datetime
+import functools
+import json
 import methods
 import logging
+import reader
+import records
+import struct
+import sys
+import validation
 
 
-def process_rows(raw_data, header, hvir_params, converters):
-    surveys = []
-    failed_rows = []
-    key_fails = {}
-    calculator = methods.hvirCalculator()
-    out_keys = None
-    for row_num, row in enumerate(raw_data):
+# Keys every survey starts with, before the row's own columns are added
+SURVEY_FIELDS = ['mass_limit', 'length_limit', 'sealed_shoulder_width', 'seal_flag', 'sealed_should_width',
+                 'form_width', 'seal_width']
+
+
+# Rollups group the calculated surveys by section, and the sections by road and owner
+ROLLUP_HEADER = ['level', 'owner', 'road_num', 'sect_num', 'segments', 'length', 'high_share', 'medium_share',
+                 'low_share', 'na_share', 'a', 'r', 'w']
+ROLLUP_DIGITS = 6
+# Running totals kept per section: segment count, int_len, int_len per cat band, and for each of a, r and w
+# the int_len weighted sum and the int_len of the surveys where it is a number
+_TOTALS = ['segments', 'length', 'High', 'Medium', 'Low', 'NA', 'a', 'a_length', 'r', 'r_length', 'w', 'w_length']
+
+
+def new_stats():
+    return {'key_fails': {}, 'failed_rows': [], 'row_count': 0}
+
+
+def process_rows(raw_data, header, hvir_params, converters, stats=None):
+    if stats is None:
+        stats = new_stats()
+    surveys = list(iter_rows(raw_data, header, hvir_params, converters, stats))
+    return stats['key_fails'], stats['failed_rows'], surveys, methods.OUT_KEYS
+
+
+def iter_rows(raw_data, header, hvir_params, converters, stats):
+    # Yields each calculated survey as its row is read, collecting key_fails and failed_rows in stats on the way
+    instrument = stats.get('instrument')
+    if instrument is None:
+        surveys = calculate_surveys(decode_rows(raw_data, header, hvir_params, stats), hvir_params, stats)
+        return rollup_surveys(surveys, stats) if 'rollup' in hvir_params else surveys
+    numbered = instrument.timed('cast', decode_rows(instrument.timed('read', raw_data), header, hvir_params, stats),
+                                inner='read')
+    surveys = calculate_surveys(numbered, hvir_params, stats)
+    if 'rollup' in hvir_params:
+        surveys = rollup_surveys(surveys, stats)
+    return instrument.timed('calculate', surveys, inner='cast')
 
+
+def get_record_type(hvir_params):
+    if 'compact' in hvir_params:
+        return records.make_record_type(hvir_params['data_params'], SURVEY_FIELDS)
+    return None
+
+
+def decode_rows(raw_data, header, hvir_params, stats, compact=True):
+    # Yields (row_num, survey) for each row that could be read. With 'validate' in hvir_params the decoder also
+    # collects the validator's columns of each row, which are checked every validation.CHUNK_ROWS rows.
+    # compact=False decodes dicts whatever --compact says, for callers that add keys records have no slot for.
+    validator = None
+    if 'validate' in hvir_params:
+        validator = validation.Validator(hvir_params['data_params'], header)
+    decode = compile_decoder(header, hvir_params['data_params'],
+                             record_type=get_record_type(hvir_params) if compact else None, collect=validator)
+    key_fails = stats['key_fails']
+    for row_num, row in enumerate(raw_data):
+        stats['row_count'] += 1
         try:
-            survey, key_fails = cast_row(row, header, converters, key_fails)
+            survey = decode(row, key_fails)
         except:
             print("Couldn't read in this row: %s" % row_num)
-            failed_rows.append(row_num)
-        survey, out_keys = calculator.method_logic(survey, hvir_params)
-        surveys.append(survey)
-        try:
-            survey, out_keys = calculator.method_logic(survey, hvir_params)
-            surveys.append(survey)
+            stats['failed_rows'].append(row_num)
+            continue
+        if validator is not None:
+            validator.row_nums.append(row_num)
+            if len(validator.row_nums) == validation.CHUNK_ROWS:
+                validator.flush()
+        yield row_num, survey
+    if validator is not None:
+        validator.flush()
+        stats['validation'] = validator.summary()
+
 
+def calculate_surveys(numbered_surveys, hvir_params, stats):
+    calculator = methods.hvirCalculator(int(hvir_params.get('cache_size', 0)))
+    if 'instrument' in stats:
+        calculator.count_paths(stats['instrument'].paths)
+    method_logic = calculator.compile(hvir_params).method_logic
+    failed_rows = stats['failed_rows']
+    for row_num, survey in numbered_surveys:
+        try:
+            survey, out_keys = method_logic(survey, row_num)
         except:
-            logging.debug("couldn't calculate HVIR for this row: %s" % str(row_num))
+            logging.debug("couldn't calculate HVIR for this row: %s", row_num)
             failed_rows.append(row_num)
+            continue
+        yield survey
+    stats['diagnostics'] = calculator.diagnostics.summary()
+    if calculator.cache_size:
+        stats['cache'] = calculator.cache_info()
+
 
-    return key_fails, failed_rows, surveys, out_keys
+def rollup_surveys(surveys, stats):
+    # Passes the calculated surveys through, adding each to its section's running totals in stats['rollup'],
+    # so memory grows with the number of sections and not the number of rows. Surveys without an int_len, or
+    # inputs without the column, count as segments with no length.
+    sections = stats.setdefault('rollup', {})
+    for survey in surveys:
+        key = (survey.get('owner'), survey.get('road_num'), survey.get('sect_num'))
+        totals = sections.get(key)
+        if totals is None:
+            totals = sections[key] = dict.fromkeys(_TOTALS, 0.0)
+        length = survey.get('int_len') or 0.0
+        totals['segments'] += 1
+        totals['length'] += length
+        totals[survey['cat'] if survey['cat'] in ('High', 'Medium', 'Low') else 'NA'] += length
+        for name in ('a', 'r', 'w'):
+            value = survey[name]
+            if value != 'NA' and value is not None:
+                totals[name] += value * length
+                totals[name + '_length'] += length
+        yield survey
+
+
+def merge_rollup(total, sections):
+    # Adds the section totals of another rollup_surveys pass, e.g. a parallel worker's, into total
+    for key, totals in sections.items():
+        if key in total:
+            for name, value in totals.items():
+                total[key][name] += value
+        else:
+            total[key] = dict(totals)
+    return total
+
+
+def rollup_rows(sections):
+    # ROLLUP_HEADER rows for every owner, road and section. Shares are of the group's int_len, a, r and w are
+    # int_len weighted means over the surveys where they are numbers.
+    roads = {}
+    owners = {}
+    for (owner, road_num, sect_num), totals in sections.items():
+        merge_rollup(roads, {(owner, road_num, None): totals})
+        merge_rollup(owners, {(owner, None, None): totals})
+    rows = []
+    for level, groups in (('owner', owners), ('road', roads), ('section', sections)):
+        for key in sorted(groups, key=lambda key: tuple('' if part is None else str(part) for part in key)):
+            rows.append(_rollup_row(level, key, groups[key]))
+    return rows
+
+
+def _rollup_row(level, key, totals):
+    # Rounded to ROLLUP_DIGITS so the summing order (e.g. across -j workers) does not show
+    length = totals['length']
+    shares = [round(totals[band] / length, ROLLUP_DIGITS) if length else None
+              for band in ('High', 'Medium', 'Low', 'NA')]
+    means = [round(totals[name] / totals[name + '_length'], ROLLUP_DIGITS) if totals[name + '_length'] else None
+             for name in ('a', 'r', 'w')]
+    return [level] + list(key) + [int(totals['segments']), round(length, ROLLUP_DIGITS)] + shares + means
 
 
 def cast_row(row, header, converters, key_fails):
@@ -52,3 +184,101 @@ def cast_row(row, header, converters, key_fails):
             else:
                 key_fails[header[index]] += 1
     return survey, key_fails
+
+
+_decoders = {}
+
+
+def compile_decoder(header, settings, columns=None, record_type=None, collect=None):
+    # Builds a function decoding a row into the same survey as cast_row, specialised to the header and the
+    # datatypes in settings. Only columns (default all) are decoded, irregular length rows fall back to cast_row.
+    # With a records.make_record_type class the survey is a compact record instead of a dict.
+    # collect is an optional validation.Validator (or any object with numeric_columns, object_columns and lists
+    # numbers and objects): each decoded row's numeric_columns values are appended to numbers packed as doubles,
+    # NaN for missing values, and a tuple of its object_columns values to objects. Such decoders are not memoized.
+    if collect is not None:
+        return _build_decoder(header, settings, columns, record_type, collect)
+    key = (tuple(header), json.dumps(settings['datatypes'], sort_keys=True), settings['datetime_format'],
+           None if columns is None else frozenset(columns), record_type)
+    if key not in _decoders:
+        _decoders[key] = _build_decoder(header, settings, columns, record_type)
+    return _decoders[key]
+
+
+def _build_decoder(header, settings, columns, record_type, collect=None):
+    converters = reader.validate_data_format(settings, header)[1]
+    parse_datetime = functools.lru_cache(maxsize=4096)(
+        functools.partial(_strptime, datetime_format=settings['datetime_format']))
+    casts = {'int': 'int(cell)', 'float': 'float(cell)', 'bool': 'bool(int(cell))',
+             'datetime': 'parse_datetime(cell)', 'str': 'cell'}
+    lines = ['def decode(row, key_fails):',
+             '    if len(row) != %d:' % len(header),
+             '        return from_survey(collect_survey(cast_row(row, header, converters, key_fails)[0]))']
+    fields = list(SURVEY_FIELDS)
+    for index, name in enumerate(header):
+        if columns is not None and name not in columns:
+            continue
+        cast = casts[settings['datatypes'][name]['type']]
+        lines += ['    cell = row[%d]' % index]
+        if cast == 'cell' and record_type is not None:
+            lines += ['    c%d = intern(cell) if cell != "" else None' % index]  # repeated names share one string
+        elif cast == 'cell':
+            lines += ['    c%d = cell if cell != "" else None' % index]
+        else:
+            lines += ['    if cell == "":',
+                      '        c%d = None' % index,
+                      '    else:',
+                      '        try:',
+                      '            c%d = %s' % (index, cast),
+                      '        except Exception:',
+                      '            c%d = None' % index,
+                      '            key_fails[%r] = key_fails.get(%r, 0) + 1' % (name, name)]
+        if name in fields:
+            fields[fields.index(name)] = (name, index)
+        else:
+            fields.append((name, index))
+    values = [(field, 'None') if isinstance(field, str) else (field[0], 'c%d' % field[1]) for field in fields]
+    collect_survey = _identity
+    if collect is not None:
+        decoded = {name: 'c%d' % index for index, name in enumerate(header) if columns is None or name in columns}
+        if collect.numeric_columns:
+            lines += ['    add_numbers(pack(%s))' % ', '.join('nan' if name not in decoded else
+                                                            'nan if %s is None else %s' % (decoded[name], decoded[name])
+                                                            for name in collect.numeric_columns)]
+        if collect.object_columns:
+            lines += ['    add_objects((%s,))' % ', '.join(decoded.get(name, 'None') for name in collect.object_columns)]
+        collect_survey = functools.partial(_collect, collect=collect)
+    if record_type is None:
+        lines += ['    return {%s}' % ', '.join('%r: %s' % value for value in values)]
+        from_survey = _identity
+    else:
+        lines += ['    survey = new_record(record_type)']
+        lines += ['    survey.%s = %s' % value for value in values]
+        lines += ['    return survey']
+        from_survey = record_type.from_dict
+    namespace = {'cast_row': cast_row, 'header': header, 'converters': converters,
+                 'parse_datetime': parse_datetime, 'from_survey': from_survey,
+                 'new_record': object.__new__, 'record_type': record_type, 'intern': sys.intern,
+                 'collect_survey': collect_survey, 'nan': float('nan')}
+    if collect is not None:
+        namespace.update(add_numbers=collect.numbers.append, add_objects=collect.objects.append,
+                         pack=struct.Struct('%dd' % len(collect.numeric_columns)).pack)
+    exec('\n'.join(lines), namespace)
+    return namespace['decode']
+
+
+def _identity(survey):
+    return survey
+
+
+def _collect(survey, collect):
+    collect.numbers.append(struct.pack('%dd' % len(collect.numeric_columns),
+                                       *[float('nan') if survey.get(name) is None else survey[name]
+                                         for name in collect.numeric_columns]))
+    if collect.object_columns:
+        collect.objects.append(tuple([survey.get(name) for name in collect.object_columns]))
+    return survey
+
+
+def _strptime(cell, datetime_format):
+    return datetime.datetime.strptime(cell, datetime_format)
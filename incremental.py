@@ -0,0 +1,125 @@
+import csv
+import compressed
+import data_processor
+import methods
+import reader
+import validation
+
+
+def calculation_columns(header):
+    # Input columns the calculator reads, a change in any of them means the row has to be recalculated
+    return [name for name in header if name in methods.BATCH_KEYS]
+
+
+def make_row_key(header, converters):
+    # Hashes the cast calculation columns, so '0' and '0.0' or '10' and '10' read from either file compare equal
+    indexes = [(header.index(name), converters[name]) for name in calculation_columns(header)]
+    road_cat_index = header.index('road_cat') if 'road_cat' in header else None
+
+    def row_key(row):
+        values = []
+        for index, converter in indexes:
+            try:
+                value = converter(row[index])
+            except:
+                value = None
+            if index == road_cat_index and value == 'na':
+                value = None  # method_logic writes a missing road_cat as na
+            values.append(value)
+        return hash(tuple(values))
+    return row_key
+
+
+def index_previous(previous_location, header, converters):
+    # unique_id --> (row key, output row) for every row of the previous output
+    with compressed.open_text(previous_location, encoding='utf-8', newline='') as csv_file:
+        csv_reader = csv.reader(csv_file)
+        previous_header = next(csv_reader, [])
+        if previous_header != header + methods.OUT_KEYS:
+            raise ValueError('Previous output %s does not match the input header' % previous_location)
+        row_key = make_row_key(header, converters)
+        id_index = header.index('unique_id')
+        return {row[id_index]: (row_key(row), row) for row in csv_reader}
+
+
+def iter_rows(rows, header, hvir_params, converters, previous, stats, delta_writer=None):
+    # Yields output rows as lists. Every row is cast, but rows whose calculation columns are unchanged since the
+    # previous output take its calculation columns instead of being calculated, only new or changed rows are
+    # calculated. Rows whose other columns changed are changed rows in the delta.
+    out_header = header + methods.OUT_KEYS
+    row_key = make_row_key(header, converters)
+    id_index = header.index('unique_id')
+    validator = None
+    if 'validate' in hvir_params:
+        validator = validation.Validator(hvir_params['data_params'], header)
+    decode = data_processor.compile_decoder(header, hvir_params['data_params'],
+                                            record_type=data_processor.get_record_type(hvir_params),
+                                            collect=validator)
+    calculator = methods.hvirCalculator(int(hvir_params.get('cache_size', 0)))
+    method_logic = calculator.compile(hvir_params).method_logic
+    changes = stats['changes']
+    for row_num, row in enumerate(rows):
+        stats['row_count'] += 1
+        previous_row = previous.pop(row[id_index], None) if len(row) > id_index else None
+        try:
+            survey = decode(row, stats['key_fails'])
+        except:
+            stats['failed_rows'].append(row_num)
+            continue
+        if validator is not None:
+            validator.row_nums.append(row_num)
+            if len(validator.row_nums) == validation.CHUNK_ROWS:
+                validator.flush()
+        if previous_row is not None and previous_row[0] == row_key(row):
+            if survey.get('road_cat') is None and 'road_cat' in header:
+                survey['road_cat'] = 'na'  # as method_logic writes it
+            out_row = [survey.get(key) for key in header] + previous_row[1][len(header):]
+            if _formatted(out_row) == previous_row[1]:
+                changes['unchanged'] += 1
+                yield out_row
+                continue
+            change = 'changed'
+        else:
+            try:
+                survey, out_keys = method_logic(survey, row_num)
+            except:
+                stats['failed_rows'].append(row_num)
+                continue
+            out_row = [survey.get(key) for key in out_header]
+            change = 'new' if previous_row is None else 'changed'
+        changes[change] += 1
+        if delta_writer is not None:
+            delta_writer.writerow([change] + out_row)
+        yield out_row
+    stats['diagnostics'] = calculator.diagnostics.summary()
+    if validator is not None:
+        validator.flush()
+        stats['validation'] = validator.summary()
+    changes['removed'] += len(previous)
+    if delta_writer is not None:
+        for key, previous_row in previous.values():
+            delta_writer.writerow(['removed'] + previous_row)
+
+
+def _formatted(out_row):
+    # The row as csv.writer writes it, to compare with a row read back from the previous output
+    return ['' if value is None else str(value) for value in out_row]
+
+
+def run(params):
+    header, rows = reader.stream_data(params)
+    type_selector, converters = reader.validate_data_format(params['data_params'], header)
+    previous = index_previous(params['previous_output'], header, converters)
+    stats = data_processor.new_stats()
+    stats['changes'] = {'unchanged': 0, 'changed': 0, 'new': 0, 'removed': 0}
+    out_header = header + methods.OUT_KEYS
+    if 'delta_output' not in params:
+        return out_header, iter_rows(rows, header, params, converters, previous, stats), stats
+    return out_header, _with_delta(params['delta_output'], rows, header, params, converters, previous, stats), stats
+
+
+def _with_delta(delta_location, rows, header, hvir_params, converters, previous, stats):
+    with compressed.open_text(delta_location, 'w', encoding=None, newline='') as delta_file:
+        delta_writer = csv.writer(delta_file)
+        delta_writer.writerow(['change'] + header + methods.OUT_KEYS)
+        yield from iter_rows(rows, header, hvir_params, converters, previous, stats, delta_writer)
@@ -0,0 +1,84 @@
+import collections
+import cProfile
+import json
+import pstats
+import time
+
+
+class Instrumentation:
+    # Collects per stage wall times and row counts, and the calculation path counts, for the json run report.
+    # Stages nest as generators (read -> cast -> calculate -> write), a stage's seconds exclude its inner stage.
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.inner = {}
+        self.paths = collections.Counter()
+        self.profiler = None
+
+    def _stage(self, name, inner):
+        if name not in self.stages:
+            self.stages[name] = {'seconds': 0.0, 'rows': 0}
+            self.inner[name] = inner
+        return self.stages[name]
+
+    def timed(self, name, iterable, inner=None):
+        # Passes iterable through, adding the time spent producing each item to the stage
+        stage = self._stage(name, inner)
+        clock = time.perf_counter
+        iterator = iter(iterable)
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                stage['seconds'] += clock() - start
+                return
+            stage['seconds'] += clock() - start
+            stage['rows'] += 1
+            yield item
+
+    def time_call(self, name, function, *args, inner=None, rows=None):
+        stage = self._stage(name, inner)
+        start = time.perf_counter()
+        value = function(*args)
+        stage['seconds'] += time.perf_counter() - start
+        if rows is not None:
+            stage['rows'] += rows(value) if callable(rows) else rows
+        return value
+
+    def start_profile(self):
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop_profile(self, dump_location=None, top=25):
+        self.profiler.disable()
+        if dump_location is not None:
+            self.profiler.dump_stats(dump_location)
+        stats = pstats.Stats(self.profiler)
+        rows = []
+        for (filename, line, function), (calls, primitive, tottime, cumtime, callers) in stats.stats.items():
+            rows.append({'function': '%s:%s(%s)' % (filename, line, function), 'calls': calls,
+                         'tottime': round(tottime, 4), 'cumtime': round(cumtime, 4)})
+        return sorted(rows, key=lambda row: row['cumtime'], reverse=True)[:top]
+
+    def report(self, stats=None, profile=None):
+        stages = {}
+        for name, stage in self.stages.items():
+            seconds = stage['seconds']
+            if self.inner[name] in self.stages:
+                seconds -= self.stages[self.inner[name]]['seconds']
+            stages[name] = {'seconds': round(seconds, 4), 'rows': stage['rows'],
+                            'rows_per_second': round(stage['rows'] / seconds, 1) if seconds > 0 else None}
+        report = {'stages': stages, 'paths': dict(sorted(self.paths.items()))}
+        if stats is not None:
+            report.update({'row_count': stats['row_count'], 'failed_rows': len(stats['failed_rows']),
+                           'key_fails': stats['key_fails']})
+            for key in ('cache', 'diagnostics', 'validation', 'pipeline', 'partitions'):
+                if key in stats:
+                    report[key] = stats[key]
+        if profile is not None:
+            report['profile'] = profile
+        return report
+
+    def write(self, location, stats=None, profile=None):
+        with open(location, 'w') as json_file:
+            json.dump(self.report(stats, profile), json_file, indent=2)
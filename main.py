@@ -1,9 +1,20 @@
 import getopt
+import logging
 import sys
 import reader
+import compressed
 import writer
 import data_processor
-import datetime
+import methods
+import parallel
+import column_cache
+import scenarios
+import sweep
+import incremental
+import instrument
+import pipeline
+import validation
+import partitions
 
 
 def get_params(argv):
@@ -13,7 +24,29 @@ def get_params(argv):
                 'w': 'w_method',
                 'o': 'outfile',
                 'l': 'logfile',
-                'c': 'config_file'}
+                'c': 'config_file',
+                's': 'stream',
+                'j': 'jobs',
+                'm': 'cache_size',
+                'compact': 'compact',
+                'cache': 'column_cache',
+                'scenarios': 'scenarios',
+                'defaults': 'defaults_file',
+                'previous': 'previous_output',
+                'delta': 'delta_output',
+                'instrument': 'instrument',
+                'profile': 'profile',
+                'validate': 'validate',
+                'rollup': 'rollup',
+                'pipeline': 'pipeline',
+                'sweep': 'sweep',
+                'compress': 'compress',
+                'level': 'compress_level',
+                'buffer-size': 'buffer_size',
+                'partition': 'partition',
+                'partition-dir': 'partition_dir',
+                'writers': 'writers',
+                'max-open': 'max_open'}
 
     # Specify some default paramaters
     params = {'config_file': 'config/settings.config',
@@ -21,7 +54,11 @@ def get_params(argv):
               'r_method': 'iri'}
     try:
         # Define the getopt parameters
-        opts, args = getopt.getopt(argv, 'f:a:r:w:o:l:')
+        opts, args = getopt.getopt(argv, 'f:a:r:w:o:l:c:sj:m:',
+                                   ['compact', 'cache=', 'scenarios=', 'defaults=', 'previous=', 'delta=',
+                                    'instrument', 'profile', 'validate', 'rollup=', 'pipeline', 'sweep=',
+                                    'compress=', 'level=', 'buffer-size=', 'partition=', 'partition-dir=',
+                                    'writers=', 'max-open='])
         if len(opts) > 0:
             keys, vals = zip(*opts)
             for k, key in enumerate(keys):
@@ -31,6 +68,7 @@ def get_params(argv):
         # Print something useful
         print('Must supply a filepath or stdin, methods specs or config settings')
         sys.exit(2)
+    compressed.check_options(params)
     return params
 
 
@@ -39,22 +77,131 @@ def main():
     argv = sys.argv[1:]
     params = get_params(argv)
     params['data_params'], type_dict = reader.get_data_settings(params['config_file'])
-    header, raw_data = reader.get_data(params)
+    instrumentation = None
+    if 'instrument' in params or 'profile' in params:
+        instrumentation = instrument.Instrumentation()
+    if 'profile' in params:
+        instrumentation.start_profile()
+    stats = run(params, instrumentation)
+    if 'rollup' in params:
+        writer.write_rollup(params['rollup'], data_processor.rollup_rows(stats.get('rollup', {})),
+                            data_processor.ROLLUP_HEADER)
+    if instrumentation is not None:
+        profile = None
+        if 'profile' in params:
+            profile = instrumentation.stop_profile(params['logfile'] + '.prof' if 'logfile' in params else None)
+        report_location = params['logfile'] + '.json' if 'logfile' in params else 'hvir_report.json'
+        instrumentation.write(report_location, stats, profile)
+
+
+def run(params, instrumentation=None):
+    if 'partition' in params:
+        for key, option in (('jobs', '-j'), ('pipeline', '--pipeline'), ('sweep', '--sweep'),
+                            ('previous_output', '--previous')):
+            if key in params and (key != 'jobs' or int(params['jobs']) > 1):
+                raise ValueError('--partition can not be combined with %s' % option)
+        partitions.check_options(params)
+    if 'rollup' in params:
+        for key, option in (('scenarios', '--scenarios'), ('sweep', '--sweep'), ('previous_output', '--previous')):
+            if key in params:
+                raise ValueError('--rollup can not be combined with %s' % option)
+    if int(params.get('jobs', 1)) > 1:
+        for key, option in (('scenarios', '--scenarios'), ('previous_output', '--previous'),
+                            ('delta_output', '--delta'), ('sweep', '--sweep'), ('column_cache', '--cache'),
+                            ('pipeline', '--pipeline')):
+            if key in params:
+                raise ValueError('-j can not be combined with %s' % option)
+        stats = parallel.run(params, int(params['jobs']))
+        write_log(params, stats)
+        return stats
+    if 'scenarios' in params:
+        out_header, surveys, stats = scenarios.run(params)
+        write_surveys(surveys, out_header, params, stats)
+        write_log(params, stats, partition_notes(stats))
+        return stats
+    if 'sweep' in params:
+        out_header, rows, stats = sweep.run(params)
+        writer.write_lists(rows, out_header, params)
+        write_log(params, stats)
+        return stats
+    if 'previous_output' in params:
+        out_header, rows, stats = incremental.run(params)
+        writer.write_lists(rows, out_header, params)
+        write_log(params, stats, ['%s rows %s' % (count, change) for change, count in stats['changes'].items()])
+        return stats
+    stats = data_processor.new_stats()
+    if instrumentation is not None:
+        stats['instrument'] = instrumentation
+    if 'column_cache' in params:
+        header, surveys, stats = column_cache.run(params, stats)
+        write_output(params, header, surveys, stats)
+    elif 'pipeline' in params:
+        pipeline.run(params, stats)
+        write_log(params, stats, pipeline.format_stages(stats['pipeline']))
+    elif 'stream' in params:
+        stream(params, stats)
+    else:
+        if instrumentation is not None:
+            # The whole file is read before the rows are cast, its own stage as cast excludes read from its time
+            header, raw_data = instrumentation.time_call('load', reader.get_data, params,
+                                                          rows=lambda value: len(value[1]))
+        else:
+            header, raw_data = reader.get_data(params)
+        type_selector, converters = reader.validate_data_format(params['data_params'], header)
+        key_fails, failed_rows, surveys, out_keys = data_processor.process_rows(raw_data, header, params,
+                                                                                converters, stats)
+        write_output(params, header, surveys, stats, streamed=False)
+    return stats
+
+
+def stream(params, stats):
+    # Rows flow from the reader through the calculator to the writer one at a time, the logfile is written
+    # once the statistics collected on the way are complete
+    header, rows = reader.stream_data(params)
     type_selector, converters = reader.validate_data_format(params['data_params'], header)
-    key_fails, failed_rows, surveys, out_keys = data_processor.process_rows(raw_data, header, params, converters)
+    surveys = data_processor.iter_rows(rows, header, params, converters, stats)
+    write_output(params, header, surveys, stats)
+
+
+def write_output(params, header, surveys, stats, streamed=True):
+    # When surveys is streamed the calculation runs inside write_data, and is taken out of the write stage time
+    instrumentation = stats.get('instrument')
+    if instrumentation is None:
+        write_surveys(surveys, header + methods.OUT_KEYS, params, stats, streamed)
+    else:
+        instrumentation.time_call('write', write_surveys, surveys, header + methods.OUT_KEYS, params, stats, streamed,
+                                  inner='calculate' if streamed else None,
+                                  rows=lambda value: stats['row_count'] - len(stats['failed_rows']))
+    write_log(params, stats, partition_notes(stats))
+
+
+def write_surveys(surveys, out_header, params, stats, streamed=False):
+    # To the output, or with --partition to a csv per partition value, counted in stats['partitions']
+    if 'partition' in params:
+        stats['partitions'] = partitions.write_partitions(surveys, out_header, params)
+    else:
+        writer.write_data(surveys, out_header, params, streamed)
+
+
+def partition_notes(stats):
+    # A total line and a line per partition file for the logfile
+    if 'partitions' not in stats:
+        return []
+    notes = ['%s rows written to %s partition files' % (sum(stats['partitions'].values()), len(stats['partitions']))]
+    return notes + ['%s rows written to %s' % (rows, name) for name, rows in stats['partitions'].items()]
+
+
+def write_log(params, stats, notes=()):
+    # The diagnostics and validation summaries are logged once here, and added to the logfile
+    diagnostics = methods.format_diagnostics(stats.get('diagnostics', {}))
+    if diagnostics:
+        logging.warning('HVIR calculation fallbacks:\n' + '\n'.join(diagnostics))
+    violations = validation.format_summary(stats.get('validation', {}))
+    if violations:
+        logging.warning('Values outside the config domains:\n' + '\n'.join(violations))
     if 'logfile' in params:
-        with open(params['logfile'], 'w') as logfile:
-            now = datetime.datetime.now()
-            logfile.writelines(['Completed: ' + now.strftime("%B %d, %Y") + '\n'])
-            logfile.writelines(['Total of %s rows were not completed' % len(failed_rows) + '\n'])
-            for key in key_fails.keys():
-                logfile.writelines([str(key_fails[key]) + ' ' + str(key) + ' key(s) could not be read' + '\n'])
-            logfile.writelines(['%s surveys read, %s surveys failed' % (len(raw_data), len(failed_rows)) + '\n'])
-            logfile.writelines(['%s percent success rate' % str(
-                round((len(raw_data) - len(failed_rows)) / len(raw_data) * 100, 2)) + '\n'])
-
-    out_header = header + out_keys
-    writer.write_data(surveys, out_header, params)
+        writer.write_log(params['logfile'], stats['key_fails'], stats['failed_rows'], stats['row_count'],
+                         stats.get('cache'), list(notes) + diagnostics + violations)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,7 @@
-import logging
+import json
+import time
+from collections import Counter, OrderedDict
+import numpy as np
 
 
 def normal_clamp(value, min_v=0, max_v=1):
@@ -7,15 +10,162 @@ def normal_clamp(value, min_v=0, max_v=1):
     return value
 
 
+def normal_clamp_batch(values, min_v=0, max_v=1):
+    # Array form of normal_clamp, must stay in step with the scalar version
+    values = np.minimum(min_v, values)
+    values = np.maximum(max_v, values)
+    return values
+
+
+# Survey keys read by method_logic, and the array dtype method_logic_batch expects for each.
+# Numeric columns use NaN for missing values, string columns use None.
+BATCH_KEYS = {'mass_limit': float,
+              'length_limit': float,
+              'avc': float,
+              'iri': float,
+              'hati': float,
+              'vcg': float,
+              'road_cat': object,
+              'seal_flag': object,
+              'line_mark': object,
+              'lane_width': float,
+              'seal_shld': float,
+              'seal_width': float,
+              'form_width': float}
+
+# a by Austroads Vehicle Class
+AVC_VALUES = {3: 0.17, 4: 0.21, 5: 0.22, 6: 0.26, 7: 0.30, 8: 0.34, 9: 0.36, 10: 0.50, 11: 0.75, 12: 1.00}
+AVC_TABLE = np.full(13, np.nan)
+for _avc, _a in AVC_VALUES.items():
+    AVC_TABLE[_avc] = _a
+
+# r by lower case road category and str(vcg)
+VCG_MAPS = {'r3': {"0": 0.0, "1": 0.70, "2": 0.55, "3": 0.40, "4": 0.20, "5": 0.0},
+            'r4': {"0": 0.0, "1": 0.65, "2": 0.48, "3": 0.30, "4": 0.15, "5": 0.0},
+            'r5': {"0": 0.0, "1": 0.60, "2": 0.40, "3": 0.20, "4": 0.10, "5": 0.0}}
+VCG_MAPS['r0'] = VCG_MAPS['r5']
+VCG_VALID = [0, 1, 2, 3, 4, 5]
+
+# Rows are road categories (r3, r4, r5/r0), columns are vcg 0-5
+VCG_CATS = ['r3', 'r4', 'r5', 'r0']
+VCG_TABLE = np.array([[0.0, 0.70, 0.55, 0.40, 0.20, 0.0],
+                      [0.0, 0.65, 0.48, 0.30, 0.15, 0.0],
+                      [0.0, 0.60, 0.40, 0.20, 0.10, 0.0],
+                      [0.0, 0.60, 0.40, 0.20, 0.10, 0.0]])
+
+
+def columns_from_surveys(surveys):
+    # Build the method_logic_batch column arrays from a list of survey dicts
+    columns = {}
+    for key, dtype in BATCH_KEYS.items():
+        if dtype is float:
+            columns[key] = np.fromiter((np.nan if s.get(key) is None else s[key] for s in surveys),
+                                       dtype=float, count=len(surveys))
+        else:
+            columns[key] = np.array([s.get(key) for s in surveys] + [None], dtype=object)[:-1]
+    return columns
+
+
+def _str_codes(values, labels, lower=True):
+    # Map a string column onto indexes into labels, -1 for missing or unmatched values
+    values = np.asarray(values, dtype=object).tolist()
+    lookup = {None: -2}
+    for value in set(values) - {None}:
+        key = value.lower() if lower else value
+        lookup[value] = labels.index(key) if key in labels else -1
+    codes = np.fromiter(map(lookup.__getitem__, values), dtype=np.int64, count=len(values))
+    missing = codes == -2
+    codes[missing] = -1
+    return codes, missing
+
+
+def _table_lookup(values, table):
+    # Array form of `table[value] if value in table`, NaN where value is not an index of the table
+    valid = np.isfinite(values) & (values == np.floor(values)) & (values >= 0) & (values < len(table))
+    index = np.where(valid, values, 0).astype(np.int64)
+    return np.where(valid, table[index], np.nan)
+
+
+# Result keys method_logic adds to each survey
+OUT_KEYS = ['a', 'w', 'r', 'minev', 'maxev', 'cat']
+
+# Fallback and invalid input reasons method_logic counts in its Diagnostics instead of logging every row
+DIAGNOSTIC_MESSAGES = {
+    'a_no_limits': 'Missing mass or length limit in a-advanced, using basic version',
+    'a_no_avc': 'No avc provided, returning default avc',
+    'a_invalid_method': 'Invalid a method specified',
+    'r_invalid_hati': 'Invalid HATI in r-hati, using default',
+    'r_invalid_method': 'Invalid r method specified, the row fails',
+    'w_marked_no_width': "Couldn't calculate w, line marking was set to Yes, but lane_width or seal_shld or "
+                         "seal_width not provided",
+    'w_unmarked_no_width': "Couldn't calculate w, line marking was set to No, but seal_width not provided",
+    'w_unsealed_no_width': "Couldn't calculate w, road is unsealed, but no from width provided",
+    'hvir_invalid_input': 'Invalid input in calc_hvir',
+    'maxev_no_road_cat': 'Missing road_cat in calc_maxev, using default',
+    'minev_no_road_cat': 'Missing road_cat in calc_minev, using default',
+}
+# Row ids kept as examples of each reason
+DIAGNOSTIC_SAMPLE_SIZE = 5
+
+
+class Diagnostics:
+    # Counts each reason, and keeps the first sample_size row ids it was seen on
+    def __init__(self, sample_size=DIAGNOSTIC_SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.counts = Counter()
+        self.samples = {}
+
+    def add(self, reasons, row_id=None):
+        for reason in reasons:
+            self.counts[reason] += 1
+            sample = self.samples.setdefault(reason, [])
+            if row_id is not None and len(sample) < self.sample_size:
+                sample.append(row_id)
+
+    def summary(self):
+        return {reason: {'count': count, 'rows': self.samples.get(reason, [])}
+                for reason, count in sorted(self.counts.items())}
+
+
+def format_diagnostics(summary):
+    # One line per reason of a Diagnostics.summary()
+    lines = []
+    for reason, entry in summary.items():
+        line = '%s rows: %s' % (entry['count'], DIAGNOSTIC_MESSAGES.get(reason, reason))
+        if entry['rows']:
+            line += ' (e.g. rows %s)' % ', '.join(str(row) for row in entry['rows'])
+        lines.append(line)
+    return lines
+
+
+def lower_road_cat(survey):
+    # The survey's road_cat lower-cased once for the r fallback and ev lookups, None when it is missing
+    road_cat = survey['road_cat']
+    return road_cat.lower() if road_cat is not None else None
+
+
 class hvirCalculator:
-    def __init__(self):
+    def __init__(self, cache_size=0):
+        # cache_size > 0 keeps an LRU cache of results keyed on the survey fields the calculation reads
         self.defaults = {}
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_miss_seconds = 0.0
+        self._cache_defaults = None
+        self._cache_defaults_key = None
+        # A Counter of the a, r and w calculation paths taken when set, see count_paths
+        self.paths = None
+        self._row_paths = None
+        self.diagnostics = Diagnostics()
+        self._row_reasons = []
 
     def calc_a_limits(self, mass_limit: float, length_limit: float, avc=None):
         # // calculates the a value for HVIR using advanced method.
 
         if mass_limit is None or length_limit is None:
-            logging.warning("Missing mass or length limit in a-advanced, using basic version.")
+            self._row_reasons.append('a_no_limits')
             return self.calc_a_avc(avc)
         else:
             # Calculate M
@@ -35,22 +185,14 @@ class hvirCalculator:
 
     def calc_a_avc(self, avc: int):
         # New method uses the Austroads Vehicle class instead of the road categories
-        avc_dict = {
-            3: 0.17,
-            4: 0.21,
-            5: 0.22,
-            6: 0.26,
-            7: 0.30,
-            8: 0.34,
-            9: 0.36,
-            10: 0.50,
-            11: 0.75,
-            12: 1.00
-        }
-        if avc in avc_dict:
-            return avc_dict[avc]
+        if avc in AVC_VALUES:
+            if self._row_paths is not None:
+                self._row_paths.append('a_avc')
+            return AVC_VALUES[avc]
         else:
-            logging.warning('No avc provided, returning default avc')
+            if self._row_paths is not None:
+                self._row_paths.append('a_default')
+            self._row_reasons.append('a_no_avc')
             return self.defaults['default_avc']
 
     def calc_r_iri(self, iri: float):
@@ -62,7 +204,7 @@ class hvirCalculator:
     def calc_r_hati(self, hati: float):
         # Calculate the r value using the basic method based on HATI.
         if hati is None:
-            logging.debug("Invalid HATI in r-hati, using default ")
+            self._row_reasons.append('r_invalid_hati')
             return 'NA'
         else:
             r = (-0.1848 * hati) + 1.0  # Updated new equation 31/1/19.
@@ -72,37 +214,10 @@ class hvirCalculator:
         if vcg is None or road_cat.lower() == 'r1' or road_cat.lower() == 'r2':
             return self.defaults['default_r_val']
         else:
-            if vcg not in [0, 1, 2, 3, 4, 5]:
+            if vcg not in VCG_VALID:
                 raise ValueError("Invalid vcg: %s" % vcg)
-            if road_cat.lower() == 'r3':
-                vcg_map = {
-                    "0": 0.0,
-                    "1": 0.70,
-                    "2": 0.55,
-                    "3": 0.40,
-                    "4": 0.20,
-                    "5": 0.0
-                }
-                return vcg_map[str(vcg)]
-            elif road_cat.lower() == 'r4':
-                vcg_map = {
-                    "0": 0.0,
-                    "1": 0.65,
-                    "2": 0.48,
-                    "3": 0.30,
-                    "4": 0.15,
-                    "5": 0.0
-                }
-                return vcg_map[str(vcg)]
-            elif road_cat.lower() in ['r5', 'r0']:
-                vcg_map = {
-                    "0": 0.0,
-                    "1": 0.60,
-                    "2": 0.40,
-                    "3": 0.20,
-                    "4": 0.10,
-                    "5": 0.0
-                }
+            vcg_map = VCG_MAPS.get(road_cat.lower())
+            if vcg_map is not None:
                 return vcg_map[str(vcg)]
             else:
                 return self.defaults['default_r_val']
@@ -146,33 +261,28 @@ class hvirCalculator:
 
     def calc_hvir(self, a: float, r: float, s: float):
         if a < 0 or r < 0 or s < 0:
-            logging.warning("Invalid input in calc_hvir ")
+            self._row_reasons.append('hvir_invalid_input')
             return 'NA'
         else:
             hvir = (0.4 * a + 0.4 * r + 0.2 * s)  # as per equation(8), but stored as 0 < hvir < 1 not %
             return hvir
 
     def calc_maxev(self, survey):
-        if survey['road_cat'] is None:
-            logging.debug("Missing road_cat in calc_minev, using default ")
-            return self.defaults['maxev']['default']
-        else:
-            cat = survey['road_cat'].lower()
-            if cat in self.defaults['maxev'].keys():
-                return self.defaults['maxev'][cat]  # as per HVIR table (4.1)
-            else:
-                return self.defaults['maxev']['default']
+        return self.calc_ev('maxev', lower_road_cat(survey))
 
     def calc_minev(self, survey):
-        if survey['road_cat'] is None:
-            logging.debug("Missing road_cat in calc_minev, using default ")
-            return self.defaults['minev']['default']
+        return self.calc_ev('minev', lower_road_cat(survey))
+
+    def calc_ev(self, ev, road_cat):
+        # The maxev or minev of a lower-cased road_cat
+        if road_cat is None:
+            self._row_reasons.append(ev + '_no_road_cat')
+            return self.defaults[ev]['default']
         else:
-            cat = survey['road_cat'].lower()
-            if cat in self.defaults['minev']:
-                return self.defaults['minev'][cat]  # as per HVIR table (4.1)
-            else:
-                return self.defaults['minev']['default']
+            return self.defaults[ev].get(road_cat, self.defaults[ev]['default'])  # as per HVIR table (4.1)
+
+    def calc_evs(self, road_cat):
+        return self.calc_ev('minev', road_cat), self.calc_ev('maxev', road_cat)
 
     def calc_cat(self, hvir: float, minev: float, maxev: float):
         if hvir is None:
@@ -192,90 +302,188 @@ class hvirCalculator:
                 # logging.warning("Missing mass or length limit in a-advanced, using basic version.")
                 a = self.calc_a_avc(survey['avc'])
             else:
-                logging.warning("Missing mass or length limit in a-advanced, using basic version.")
+                if self._row_paths is not None:
+                    self._row_paths.append('a_default')
+                self._row_reasons.append('a_no_limits')
                 a = self.defaults['default_avc']
         else:
+            if self._row_paths is not None:
+                self._row_paths.append('a_limits')
             a = self.calc_a_limits(mass_limit=survey['mass_limit'], length_limit=survey['length_limit'],
                                    avc=survey['avc'])
         return a
 
-    def a_method_logic(self, survey, hvir_params):
+    def a_method_avc(self, survey):
+        return self.a_method_heirachy(survey, skip_limits=True)
+
+    def a_method_invalid(self, survey):
+        self._row_reasons.append('a_invalid_method')
+        if self._row_paths is not None:
+            self._row_paths.append('a_na')
+        return 'NA'  # invalid a_method provided
+
+    def a_function(self, a_method):
         # a calc
         # 1. Check selected calculation method (limits or avc),
         # 2. check if required input data is present,
         # 3. if not fall back from limits --> avc --> default a value.
-        if hvir_params['a_method'] == "limits":
-            a = self.a_method_heirachy(survey)
-        elif hvir_params['a_method'] == "avc":
-            a = self.a_method_heirachy(survey, skip_limits=True)
+        # Returns the a calculation of a_method, a function of the survey
+        if a_method == "limits":
+            return self.a_method_heirachy
+        elif a_method == "avc":
+            return self.a_method_avc
         else:
-            logging.debug('Invalid a method specified: %s' % hvir_params['a_method'])
-            a = 'NA'  # invalid a_method provided
-        return a
+            return self.a_method_invalid
+
+    def a_method_logic(self, survey, hvir_params):
+        return self.a_function(hvir_params['a_method'])(survey)
 
-    def r_method_fallback(self, survey):
-        if survey['vcg'] is None or survey['road_cat'].lower() == 'r1' or survey['road_cat'].lower() == 'r2':
+    def r_method_fallback(self, survey, road_cat):
+        # road_cat is lower-cased, a row with a vcg and no road_cat fails in calc_r_vcg
+        if survey['vcg'] is None or road_cat == 'r1' or road_cat == 'r2':
             r = 'NA'
         else:
-            r = self.calc_r_vcg(survey['vcg'], survey['road_cat'])  # UA Needs check for vcg data present?
+            r = self.calc_r_vcg(survey['vcg'], road_cat)  # UA Needs check for vcg data present?
+        if self._row_paths is not None:
+            self._row_paths.append('r_vcg' if r != 'NA' else 'r_na')
         return r
 
-    def r_method_logic(self, survey, hvir_params):
+    def r_unsealed(self):
+        if self._row_paths is not None:
+            self._row_paths.append('r_unsealed')
+        return 'NA'
+
+    def r_method_iri(self, survey, road_cat):
+        if survey['seal_flag'] == 'Unsealed':
+            return self.r_unsealed()
+        if survey['iri'] is None:
+            return self.r_method_fallback(survey, road_cat)
+        if self._row_paths is not None:
+            self._row_paths.append('r_iri')
+        return self.calc_r_iri(survey['iri'])
+
+    def r_method_hati(self, survey, road_cat):
+        if survey['seal_flag'] == 'Unsealed':
+            return self.r_unsealed()
+        if survey['hati'] is None:
+            return self.r_method_fallback(survey, road_cat)
+        if self._row_paths is not None:
+            self._row_paths.append('r_hati')
+        return self.calc_r_hati(survey['hati'])
+
+    def r_function(self, r_method):
         # 1. Check selected calculation method (iri, hati, vcg),
         # 2. Check if required input data is present,
         # 3. If not fall back from iri OR hati --> vcg --> default r result (NA).
-        if survey['seal_flag'] == 'Unsealed':
-            r = 'NA'
-        else:
-            if hvir_params['r_method'] == "iri":  # iri
-                if survey['iri'] is None:
-                    r = self.r_method_fallback(survey)
-                else:
-                    r = self.calc_r_iri(survey['iri'])
+        # Returns the r calculation of r_method, a function of the survey and its lower-cased road_cat. Unsealed
+        # roads are NA for any method, otherwise an invalid method fails the row.
+        if r_method == "iri":
+            return self.r_method_iri
+        elif r_method == 'hati':
+            return self.r_method_hati
 
-            elif hvir_params['r_method'] == 'hati':  # hati
-                if survey['hati'] is None:
-                    r = self.r_method_fallback(survey)
-                else:
-                    r = self.calc_r_hati(survey['hati'])
-            else:
-                logging.debug('Invalid r method specified: %s', survey['r_method'])
-                r = 'NA'
-        return r
+        def r_method_invalid(survey, road_cat):
+            if survey['seal_flag'] == 'Unsealed':
+                return self.r_unsealed()
+            self._row_reasons.append('r_invalid_method')
+            raise ValueError('Invalid r method %s' % r_method)
+        return r_method_invalid
+
+    def r_method_logic(self, survey, hvir_params):
+        return self.r_function(hvir_params['r_method'])(survey, lower_road_cat(survey))
 
     def w_method_logic(self, survey):
         # New logic to allow for unsealed and unmarked roads cases
         if survey['seal_flag'].lower() == 'sealed' or survey['seal_flag'] is None:
             if survey['line_mark'].lower() == 'yes' or survey['line_mark'].lower() is None:
                 if survey['lane_width'] is not None and survey['seal_shld'] is not None:
+                    path = 'w_marked'
                     w = self.calc_w_by_geom(survey['lane_width'],
                                             survey['seal_shld'])  # Assume sealed and marked
                 else:
                     if survey['seal_width'] is None:
-                        logging.debug(
-                            "Couldn't calculate w, line marking was set to Yes, but lane_width or seal_shld or "
-                            "seal_width not provided")
+                        self._row_reasons.append('w_marked_no_width')
+                        path = 'w_na'
                         w = 'NA'
                     else:
+                        path = 'w_unmarked'
                         w = self.calc_w_geom_unmarked(survey['seal_width'])  # sealed but not marked
             else:  # Line marking is yes
                 if survey['seal_width'] is None:
-                    logging.debug(
-                        "Couldn't calculate w, line marking was set to No, but seal_width not provided")
+                    self._row_reasons.append('w_unmarked_no_width')
+                    path = 'w_na'
                     w = 'NA'
                 else:
+                    path = 'w_unmarked'
                     w = self.calc_w_geom_unmarked(survey['seal_width'])  # sealed but not marked
         elif survey['form_width'] is not None:
+            path = 'w_unsealed'
             w = self.calc_w_geom_unsealed(survey['form_width'])  # Calculate for unsealed roads
         else:
-            logging.debug("Couldn't calculate w, road is unsealed, but no from width provided")
+            self._row_reasons.append('w_unsealed_no_width')
+            path = 'w_na'
             w = 'NA'
+        if self._row_paths is not None:
+            self._row_paths.append(path)
         return w
 
-    def method_logic(self, survey, hvir_params):
+    def compile(self, hvir_params):
+        # A CalculationPlan for many method_logic calls with the same hvir_params
+        return CalculationPlan(self, hvir_params)
+
+    def method_logic(self, survey, hvir_params, row_id=None):
+        # row_id is only used for the sample rows of self.diagnostics
         self.defaults = hvir_params['data_params']['default_values']
-        a = self.a_method_logic(survey, hvir_params)
-        r = self.r_method_logic(survey, hvir_params)
+        if self.cache_size:
+            key = self.cache_key(survey, hvir_params)
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+            else:
+                start = time.perf_counter()
+                entry = self._calc_results(survey, hvir_params, row_id), self._row_paths, self._row_reasons
+                self.cache_miss_seconds += time.perf_counter() - start
+                self.cache_misses += 1
+                self.cache[key] = entry
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            results, row_paths, row_reasons = entry
+        else:
+            results = self._calc_results(survey, hvir_params, row_id)
+            row_paths, row_reasons = self._row_paths, self._row_reasons
+        if row_paths is not None and self.paths is not None:
+            self.paths.update(row_paths)
+        if row_reasons:
+            self.diagnostics.add(row_reasons, row_id)
+        if survey['road_cat'] is None:
+            survey['road_cat'] = "NA".lower()
+        survey['a'], survey['w'], survey['r'], survey['minev'], survey['maxev'], survey['cat'] = results
+        return survey, OUT_KEYS
+
+    def _calc_results(self, survey, hvir_params, row_id):
+        # The paths and reasons met before a row fails are counted too
+        try:
+            return self.calc_results(survey, hvir_params)
+        except Exception:
+            if self._row_paths is not None:
+                self.paths.update(self._row_paths)
+            if self._row_reasons:
+                self.diagnostics.add(self._row_reasons, row_id)
+            raise
+
+    def count_paths(self, paths):
+        # Count the a, r and w calculation path of every row method_logic calculates into the paths Counter,
+        # e.g. a_limits/a_avc/a_default, r_iri/r_hati/r_vcg/r_na/r_unsealed and w_marked/w_unmarked/w_unsealed/w_na
+        self.paths = paths
+        self.cache.clear()
+
+    def calc_results(self, survey, hvir_params):
+        self._row_paths = [] if self.paths is not None else None
+        self._row_reasons = []
+        road_cat = lower_road_cat(survey)
+        a = self.a_function(hvir_params['a_method'])(survey)
+        r = self.r_function(hvir_params['r_method'])(survey, road_cat)
         w = self.w_method_logic(survey)
         # logger.(a,r,w,survey['road_cat'])
         # UA As discussed, this is 'NA' or specifically a lack of Leeway Input Data.
@@ -287,20 +495,208 @@ class hvirCalculator:
             hvir = 'NA'
         else:
             hvir = 'NA'
-        maxev = self.calc_maxev(survey)
-        minev = self.calc_minev(survey)
-        if survey['road_cat'] is None:
-            survey['road_cat'] = "NA".lower()
+        minev, maxev = self.calc_evs(road_cat)
         if survey['road_cat'] == "r0":  # In all cases.if road_Cat is R0 then always return Medium even if undefined
             # values.
             cat = "Medium"
         else:
             cat = self.calc_cat(hvir, minev, maxev)
+        return a, w, r, minev, maxev, cat
+
+    def cache_key(self, survey, hvir_params):
+        # Only the fields a_method_logic, r_method_logic, w_method_logic and the ev/cat lookups read
+        if self.defaults is not self._cache_defaults:
+            self._cache_defaults = self.defaults
+            self._cache_defaults_key = json.dumps(self.defaults, sort_keys=True)
+        return (tuple([survey.get(key) for key in BATCH_KEYS]) +
+                (hvir_params['a_method'], hvir_params['r_method'], self._cache_defaults_key))
+
+    def cache_info(self):
+        calls = self.cache_hits + self.cache_misses
+        return {'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'size': len(self.cache),
+                'max_size': self.cache_size,
+                'hit_rate': self.cache_hits / calls if calls else 0.0,
+                'estimated_saved_seconds': (self.cache_hits * self.cache_miss_seconds / self.cache_misses
+                                            if self.cache_misses else 0.0)}
 
-        survey['a'] = a
-        survey['w'] = w
-        survey['r'] = r
-        survey['minev'] = minev
-        survey['maxev'] = maxev
-        survey['cat'] = cat
-        return survey, ['a', 'w', 'r', 'minev', 'maxev', 'cat']
+    def calc_w_by_geom_batch(self, lane_width, sealed_should_width):
+        w_lw = normal_clamp_batch(lane_width / 5.8)
+        w_ssw = normal_clamp_batch(sealed_should_width / 3.0)  # as per HVIR index calculation equation (6b)
+        return (w_lw + w_ssw) / 2.0  # as per HVIR index calculation equation (6c)
+
+    def calc_w_geom_batch(self, width):
+        # Array form of calc_w_geom_unmarked and calc_w_geom_unsealed, which share the same width split
+        half_width = width / 2.0
+        lane_width = np.where(half_width <= 2.9, half_width,
+                              np.where(half_width <= 5.8, 2.9 + ((half_width - 2.9) / 2.0), 5.8))
+        sealed_shoulder_width = np.where(half_width <= 2.9, 0.0,
+                                         np.where(half_width <= 5.8, (half_width - 2.9) / 2.0, half_width - 5.8))
+        return self.calc_w_by_geom_batch(lane_width, sealed_shoulder_width)
+
+    def a_method_batch(self, columns, hvir_params, failed):
+        # Array form of a_method_logic, the limits --> avc --> default a value fallback is selected by mask
+        n = len(failed)
+        if hvir_params['a_method'] not in ('limits', 'avc'):
+            return np.full(n, np.nan)  # invalid a_method provided
+        if hvir_params['a_method'] == 'limits':
+            use_limits = ~np.isnan(columns['mass_limit']) & ~np.isnan(columns['length_limit'])
+        else:
+            use_limits = np.zeros(n, dtype=bool)
+        a = _table_lookup(columns['avc'], AVC_TABLE)
+        use_default = ~use_limits & np.isnan(a)
+        if 'default_avc' in self.defaults:
+            a[use_default] = self.defaults['default_avc']
+        else:
+            failed |= use_default  # calc_a_avc raises a KeyError without a default
+        if use_limits.any():
+            m = normal_clamp_batch(columns['mass_limit'] / 119.0)
+            l = normal_clamp_batch(columns['length_limit'] / 53.5)
+            failed |= use_limits & (l == 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                a = np.where(use_limits, (2.0 * m) / (1.0 + (m / l)), a)
+        return a
+
+    def r_method_batch(self, columns, hvir_params, failed):
+        # Array form of r_method_logic, the iri OR hati --> vcg --> NA fallback is selected by mask
+        r = np.full(len(failed), np.nan)
+        sealed = ~np.equal(columns['seal_flag'], 'Unsealed')
+        if hvir_params['r_method'] == 'iri':
+            measured = columns['iri']
+            r_measured = normal_clamp_batch((-0.1 * measured) + 1.0)
+        elif hvir_params['r_method'] == 'hati':
+            measured = columns['hati']
+            r_measured = normal_clamp_batch((-0.1848 * measured) + 1.0)
+        else:
+            failed |= sealed  # r_method_logic raises a ValueError on the invalid method
+            return r
+        has_measured = ~np.isnan(measured)
+        r[sealed & has_measured] = r_measured[sealed & has_measured]
+
+        vcg = columns['vcg']
+        fallback = sealed & ~has_measured & ~np.isnan(vcg)
+        cat_codes, cat_missing = _str_codes(columns['road_cat'], ['r1', 'r2', 'r3', 'r4', 'r5', 'r0'])
+        failed |= fallback & cat_missing
+        fallback &= ~cat_missing & (cat_codes != 0) & (cat_codes != 1)  # r1 and r2 stay NA
+        valid_vcg = (vcg >= 0) & (vcg <= 5) & (vcg == np.floor(vcg))
+        failed |= fallback & ~valid_vcg  # calc_r_vcg raises on an invalid vcg
+        fallback &= valid_vcg
+        has_table = cat_codes > 1
+        if 'default_r_val' in self.defaults:
+            r_vcg = np.full(len(r), self.defaults['default_r_val'], dtype=float)
+        else:
+            r_vcg = np.full(len(r), np.nan)
+            failed |= fallback & ~has_table
+        rows = np.where(has_table, cat_codes - 2, 0)
+        vcg_index = np.where(valid_vcg, vcg, 0).astype(np.int64)
+        r_vcg[has_table] = VCG_TABLE[rows, vcg_index][has_table]
+        r[fallback] = r_vcg[fallback]
+        return r
+
+    def w_method_batch(self, columns, failed):
+        # Array form of w_method_logic, geometry marked/unmarked/unsealed is selected by mask
+        w = np.full(len(failed), np.nan)
+        seal_codes, seal_missing = _str_codes(columns['seal_flag'], ['sealed'])
+        failed |= seal_missing
+        sealed = seal_codes == 0
+        mark_codes, mark_missing = _str_codes(columns['line_mark'], ['yes'])
+        failed |= sealed & mark_missing
+        marked = sealed & (mark_codes == 0) & ~np.isnan(columns['lane_width']) & ~np.isnan(columns['seal_shld'])
+        unmarked = sealed & ~marked & ~np.isnan(columns['seal_width'])
+        unsealed = ~sealed & ~seal_missing & ~np.isnan(columns['form_width'])
+        w[marked] = self.calc_w_by_geom_batch(columns['lane_width'][marked], columns['seal_shld'][marked])
+        w[unmarked] = self.calc_w_geom_batch(columns['seal_width'][unmarked])
+        w[unsealed] = self.calc_w_geom_batch(columns['form_width'][unsealed])
+        return w
+
+    def calc_hvir_batch(self, a, r, w, failed):
+        computed = ~np.isnan(r) & ~np.isnan(w)
+        failed |= computed & np.isnan(a)  # calc_hvir raises comparing an NA a value
+        valid = computed & (a >= 0) & (r >= 0) & (w >= 0)
+        return np.where(valid, 0.4 * a + 0.4 * r + 0.2 * w, np.nan)  # as per equation(8)
+
+    def calc_ev_batch(self, road_cat, ev_table):
+        # Array form of calc_maxev and calc_minev, road_cat is looked up case-insensitively
+        labels = list(ev_table.keys())
+        codes, _ = _str_codes(road_cat, labels)
+        values = np.array([ev_table[label] for label in labels] + [ev_table['default']], dtype=float)
+        return values[codes]  # -1 selects the default
+
+    def calc_cat_batch(self, road_cat, hvir, minev, maxev, failed):
+        is_r0 = np.equal(road_cat, 'r0')  # R0 is always Medium
+        failed |= ~is_r0 & (np.isnan(hvir) | (minev >= maxev))  # calc_cat raises on NA hvir or bad bands
+        cat = np.select([hvir > maxev, hvir >= minev], ['High', 'Medium'], 'Low').astype(object)
+        cat[is_r0] = 'Medium'
+        return cat
+
+    def method_logic_batch(self, columns, hvir_params):
+        # Array form of method_logic over BATCH_KEYS columns. NA results are NaN, and rows where method_logic
+        # would raise are flagged in 'failed' with NA results.
+        self.defaults = hvir_params['data_params']['default_values']
+        failed = np.zeros(len(columns['road_cat']), dtype=bool)
+        a = self.a_method_batch(columns, hvir_params, failed)
+        r = self.r_method_batch(columns, hvir_params, failed)
+        w = self.w_method_batch(columns, failed)
+        hvir = self.calc_hvir_batch(a, r, w, failed)
+        maxev = self.calc_ev_batch(columns['road_cat'], self.defaults['maxev'])
+        minev = self.calc_ev_batch(columns['road_cat'], self.defaults['minev'])
+        cat = self.calc_cat_batch(columns['road_cat'], hvir, minev, maxev, failed)
+        for values in (a, r, w, hvir, minev, maxev):
+            values[failed] = np.nan
+        cat[failed] = 'NA'
+        return {'a': a, 'r': r, 'w': w, 'hvir': hvir, 'minev': minev, 'maxev': maxev, 'cat': cat,
+                'failed': failed}
+
+
+class CalculationPlan:
+    # hvirCalculator.method_logic for fixed hvir_params, built from the same a, r, w and ev helpers with the a and
+    # r functions and the defaults chosen once, the ev lookups done once per road_cat and no cache checks on every
+    # call. Gives the same results, diagnostics and path counts as method_logic, and uses it when the calculator
+    # has a cache. The calculator's defaults are set for the plan, so it should not be shared with other params.
+    def __init__(self, calculator, hvir_params):
+        self.calculator = calculator
+        self.hvir_params = hvir_params
+        calculator.defaults = hvir_params['data_params']['default_values']
+        self.a_function = calculator.a_function(hvir_params['a_method'])
+        self.r_function = calculator.r_function(hvir_params['r_method'])
+        self.evs = {}
+        if calculator.cache_size:
+            self.method_logic = self.cached_method_logic
+
+    def cached_method_logic(self, survey, row_id=None):
+        return self.calculator.method_logic(survey, self.hvir_params, row_id)
+
+    def method_logic(self, survey, row_id=None):
+        # hvirCalculator.method_logic with the road_cat lower-cased once and the (minev, maxev) of known road_cats
+        # reused. The paths and reasons met before a row fails are counted too.
+        calculator = self.calculator
+        row_paths = calculator._row_paths = [] if calculator.paths is not None else None
+        row_reasons = calculator._row_reasons = []
+        road_cat = survey['road_cat']
+        lower_cat = road_cat.lower() if road_cat is not None else None
+        try:
+            a = self.a_function(survey)
+            r = self.r_function(survey, lower_cat)
+            w = calculator.w_method_logic(survey)
+            hvir = calculator.calc_hvir(a, r, w) if r != 'NA' and w != 'NA' else 'NA'
+            evs = self.evs.get(lower_cat)
+            if evs is None:
+                evs = calculator.calc_evs(lower_cat)
+                if lower_cat is not None:
+                    self.evs[lower_cat] = evs
+            minev, maxev = evs
+            if road_cat == 'r0':
+                cat = 'Medium'
+            else:
+                cat = calculator.calc_cat(hvir, minev, maxev)
+        finally:
+            if row_paths is not None:
+                calculator.paths.update(row_paths)
+            if row_reasons:
+                calculator.diagnostics.add(row_reasons, row_id)
+        if road_cat is None:
+            survey['road_cat'] = 'na'
+        survey['a'], survey['w'], survey['r'] = a, w, r
+        survey['minev'], survey['maxev'], survey['cat'] = minev, maxev, cat
+        return survey, OUT_KEYS
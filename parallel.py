@@ -0,0 +1,154 @@
+import csv
+import io
+import mmap
+import multiprocessing
+import os
+import stat
+import sys
+import compressed
+import data_processor
+import methods
+import reader
+import validation
+import writer
+
+# Upper bound on the bytes of input handled by one task, keeps worker memory and result size bounded
+MAX_RANGE_BYTES = 8 * 1024 * 1024
+
+_worker = {}
+
+
+def get_source(params):
+    # Same precedence as reader.get_data, stdin is used when it is redirected from a regular file
+    if not sys.stdin.isatty():
+        if not stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode):
+            raise ValueError('Parallel mode needs a file, stdin is a pipe')
+        if compressed.detect('/dev/stdin') is not None:
+            raise ValueError('Parallel mode needs an uncompressed csv, stdin is compressed')
+        return '/dev/stdin'
+    csv_file, csv_reader = reader.load_csv(params['filepath'])
+    csv_file.close()
+    if compressed.detect(params['filepath']) is not None:
+        raise ValueError('Parallel mode needs an uncompressed csv, %s is compressed' % params['filepath'])
+    return params['filepath']
+
+
+def read_header(data):
+    # Returns the header and the offset the data rows start at, header detection matches reader.iter_file
+    end = data.find(b'\n')
+    end = len(data) if end == -1 else end + 1
+    header, rows = reader.iter_file(csv.reader(io.StringIO(data[:end].decode('utf-8'), newline='')))
+    if not header:
+        return header, 0
+    return header, end
+
+
+def split_ranges(data, start, n_ranges):
+    # Splits data[start:] into byte ranges ending on line boundaries. Rows must not contain quoted newlines.
+    size = len(data) - start
+    step = max(1, min(MAX_RANGE_BYTES, -(-size // n_ranges)))
+    ranges = []
+    while start < len(data):
+        end = data.find(b'\n', min(start + step, len(data)) - 1)
+        end = len(data) if end == -1 else end + 1
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _init_worker(source, header, params, lineterminator):
+    _worker['source'] = open(source, 'rb')
+    _worker['data'] = mmap.mmap(_worker['source'].fileno(), 0, access=mmap.ACCESS_READ)
+    _worker['header'] = header
+    _worker['params'] = params
+    _worker['converters'] = reader.validate_data_format(params['data_params'], header)[1]
+    _worker['out_header'] = header + methods.OUT_KEYS
+    _worker['lineterminator'] = lineterminator
+
+
+def _process_range(byte_range):
+    # Parses, casts and calculates one byte range, only the formatted output and statistics are sent back
+    start, end = byte_range
+    text = _worker['data'][start:end].decode('utf-8')
+    stats = data_processor.new_stats()
+    surveys = data_processor.iter_rows(csv.reader(io.StringIO(text, newline='')), _worker['header'],
+                                       _worker['params'], _worker['converters'], stats)
+    chunk = writer.format_rows(surveys, _worker['out_header'], _worker['lineterminator'])
+    return chunk, stats
+
+
+def run(params, jobs):
+    source = get_source(params)
+    with open(source, 'rb') as csv_file:
+        if os.fstat(csv_file.fileno()).st_size == 0:
+            header, ranges = [], []
+        else:
+            with mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                header, start = read_header(data)
+                ranges = split_ranges(data, start, jobs * 4)
+    reader.validate_data_format(params['data_params'], header)
+    stats = data_processor.new_stats()
+    with multiprocessing.Pool(jobs, initializer=_init_worker,
+                              initargs=(source, header, params, writer.get_lineterminator())) as pool:
+        chunks = merge_stats(pool.imap(_process_range, ranges), stats, 'unique_id' in header)
+        writer.write_chunks(chunks, header + methods.OUT_KEYS, params)
+    return stats
+
+
+def merge_stats(results, stats, has_ids=True):
+    # Yields the output chunks in input order, offsetting each range's failed row numbers by the rows before it.
+    # Validation samples are row numbers as well when the header has no unique_id.
+    for chunk, range_stats in results:
+        for key, fails in range_stats['key_fails'].items():
+            stats['key_fails'][key] = stats['key_fails'].get(key, 0) + fails
+        stats['failed_rows'].extend(row_num + stats['row_count'] for row_num in range_stats['failed_rows'])
+        if 'diagnostics' in range_stats:
+            stats['diagnostics'] = merge_diagnostics(stats.get('diagnostics', {}), range_stats['diagnostics'],
+                                                     stats['row_count'])
+        if 'rollup' in range_stats:
+            data_processor.merge_rollup(stats.setdefault('rollup', {}), range_stats['rollup'])
+        if 'validation' in range_stats:
+            stats['validation'] = merge_validation(stats.get('validation', {}), range_stats['validation'],
+                                                   0 if has_ids else stats['row_count'])
+        stats['row_count'] += range_stats['row_count']
+        if 'cache' in range_stats:
+            stats['cache'] = merge_cache_info(stats.get('cache'), range_stats['cache'])
+        yield chunk
+
+
+def merge_cache_info(total, cache_info):
+    # Each worker has its own cache, hits, misses and saved time add up and the hit rate is recomputed
+    if total is None:
+        return dict(cache_info)
+    total = dict(total)
+    for key in ('hits', 'misses', 'estimated_saved_seconds'):
+        total[key] += cache_info[key]
+    total['size'] = max(total['size'], cache_info['size'])
+    calls = total['hits'] + total['misses']
+    total['hit_rate'] = total['hits'] / calls if calls else 0.0
+    return total
+
+
+def merge_diagnostics(total, diagnostics, offset):
+    # Counts add up, the sample rows are offset like failed_rows and kept to the first sample size of them
+    total = dict(total)
+    for reason, entry in diagnostics.items():
+        rows = [row_num + offset for row_num in entry['rows']]
+        if reason in total:
+            total[reason] = {'count': total[reason]['count'] + entry['count'],
+                             'rows': (total[reason]['rows'] + rows)[:methods.DIAGNOSTIC_SAMPLE_SIZE]}
+        else:
+            total[reason] = {'count': entry['count'], 'rows': rows}
+    return dict(sorted(total.items()))
+
+
+def merge_validation(total, summary, offset):
+    total = dict(total)
+    for name, entry in summary.items():
+        ids = [row_id + offset for row_id in entry['unique_ids']] if offset else entry['unique_ids']
+        if name in total:
+            total[name] = dict(total[name], count=total[name]['count'] + entry['count'],
+                               unique_ids=(total[name]['unique_ids'] + ids)[:validation.SAMPLE_SIZE])
+        else:
+            total[name] = dict(entry, unique_ids=ids)
+    return total
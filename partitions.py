@@ -0,0 +1,171 @@
+import collections
+import csv
+import os
+import queue
+import re
+import threading
+import compressed
+import pipeline
+import writer
+
+DEFAULT_DIRECTORY = 'partitions'
+DEFAULT_WRITERS = 2
+DEFAULT_MAX_OPEN = 64
+# Rows buffered for one partition before they are handed to its writer, and for all partitions together
+CHUNK_ROWS = writer.WRITE_CHUNK_ROWS
+MAX_BUFFERED_ROWS = 16 * CHUNK_ROWS
+QUEUE_CHUNKS = 16
+MISSING_NAME = '_missing'
+
+
+def partition_name(value):
+    # File name stem for a partition value, characters that are not safe in file names become _
+    if value is None or value == '':
+        return MISSING_NAME
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(value)).strip('.') or MISSING_NAME
+
+
+def check_options(params):
+    # Raises a ValueError for --writers or --max-open values that are not at least 1, before any work is done
+    for key, option in (('writers', '--writers'), ('max_open', '--max-open')):
+        if key in params and (not params[key].isdigit() or int(params[key]) < 1):
+            raise ValueError('%s must be a number of at least 1, not %s' % (option, params[key]))
+
+
+class PartitionWriter:
+    # Writes rows to one csv per partition value in directory, in a single pass. Rows are buffered per partition
+    # and written in writerows chunks by writer threads, each owning a share of the partitions so a file only ever
+    # has one writer. Each thread keeps at most max_open / writers files open, reopening closed ones for appending,
+    # so there are no more writers than max_open.
+    def __init__(self, directory, out_header, params, writers=DEFAULT_WRITERS, max_open=DEFAULT_MAX_OPEN):
+        if writers < 1 or max_open < 1:
+            raise ValueError('A partition writer needs at least 1 writer and 1 open file')
+        writers = min(writers, max_open)
+        self.directory = directory
+        self.out_header = out_header
+        self.codec, self.level, self.buffer_size = compressed.params_options(params)
+        self.extension = '.csv' + {None: '', 'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}[self.codec]
+        self.max_open = max_open // writers
+        self.names = {}
+        self.used_names = set()
+        self.buffers = {}
+        self.buffered = 0
+        self.rows = collections.Counter()
+        self.stop = threading.Event()
+        self.errors = []
+        self.stage = pipeline.Stage(self.stop)
+        self.queues = [queue.Queue(QUEUE_CHUNKS) for n in range(writers)]
+        self.threads = [threading.Thread(target=self._run_writer, args=(chunks,), daemon=True)
+                        for chunks in self.queues]
+        os.makedirs(directory, exist_ok=True)
+        for thread in self.threads:
+            thread.start()
+
+    def location(self, value):
+        # Partition values are given distinct file names, and each is assigned to a writer in turn
+        if value not in self.names:
+            name = partition_name(value)
+            stem, number = name, 1
+            while name in self.used_names:
+                number += 1
+                name = '%s_%s' % (stem, number)
+            self.used_names.add(name)
+            writer_index = len(self.names) % len(self.queues)
+            self.names[value] = (os.path.join(self.directory, name + self.extension), writer_index)
+        return self.names[value]
+
+    def add(self, value, row):
+        rows = self.buffers.get(value)
+        if rows is None:
+            rows = self.buffers[value] = []
+        rows.append(row)
+        self.buffered += 1
+        if len(rows) == CHUNK_ROWS:
+            self.flush(value)
+        elif self.buffered >= MAX_BUFFERED_ROWS:
+            for buffered_value in list(self.buffers):
+                self.flush(buffered_value)
+
+    def flush(self, value):
+        if self.stop.is_set():
+            raise self.errors[0]
+        rows = self.buffers.pop(value)
+        self.buffered -= len(rows)
+        location, writer_index = self.location(value)
+        self.rows[os.path.basename(location)] += len(rows)
+        try:
+            self.stage.put(self.queues[writer_index], (location, rows))
+        except pipeline.Stopped:
+            raise self.errors[0]
+
+    def close(self):
+        # Writes out the buffered rows and waits for the writers, raising the first error of any of them
+        try:
+            for value in list(self.buffers):
+                self.flush(value)
+            for chunks in self.queues:
+                self.stage.put(chunks, None)
+        except BaseException:
+            self.stop.set()
+            raise
+        finally:
+            for thread in self.threads:
+                thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def _run_writer(self, chunks):
+        handles = collections.OrderedDict()
+        created = set()
+        try:
+            while True:
+                item = self.stage.get(chunks)
+                if item is None:
+                    break
+                location, rows = item
+                handle = handles.pop(location, None)
+                if handle is None:
+                    if len(handles) >= self.max_open:
+                        handles.popitem(last=False)[1][0].close()
+                    handle = self._open(location, location in created)
+                    created.add(location)
+                handles[location] = handle
+                handle[1].writerows(rows)
+        except pipeline.Stopped:
+            pass
+        except BaseException as error:
+            self.errors.append(error)
+            self.stop.set()
+        finally:
+            for out_file, csv_writer in handles.values():
+                out_file.close()
+
+    def _open(self, location, append):
+        # Compressed files are appended to as further compressed streams, which their tools read as one
+        out_file = compressed.open_text(location, 'a' if append else 'w', self.codec, self.level, self.buffer_size,
+                                        encoding=None, newline='')
+        csv_writer = csv.writer(out_file)
+        if not append:
+            csv_writer.writerow(self.out_header)
+        return out_file, csv_writer
+
+
+def write_partitions(surveys, out_header, params):
+    # Splits the surveys by their params['partition'] column into one csv each in params['partition_dir'],
+    # returns the rows written to each file name
+    column = params['partition']
+    if column not in out_header:
+        raise ValueError('Cannot partition on %s, it is not an output column' % column)
+    partition_writer = PartitionWriter(params.get('partition_dir', DEFAULT_DIRECTORY), out_header, params,
+                                       int(params.get('writers', DEFAULT_WRITERS)),
+                                       int(params.get('max_open', DEFAULT_MAX_OPEN)))
+    try:
+        for survey in surveys:
+            partition_writer.add(survey.get(column), writer.project(survey, out_header))
+    except BaseException:
+        partition_writer.stop.set()
+        for thread in partition_writer.threads:
+            thread.join()
+        raise
+    partition_writer.close()
+    return dict(sorted(partition_writer.rows.items()))
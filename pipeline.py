@@ -0,0 +1,185 @@
+import csv
+import queue
+import threading
+import time
+import data_processor
+import methods
+import reader
+import writer
+
+CHUNK_ROWS = 1024
+# Chunks each queue holds before the stage feeding it waits
+QUEUE_CHUNKS = 16
+STAGES = ['read', 'calculate', 'write']
+
+
+class Stopped(Exception):
+    # Raised in a stage when another stage failed
+    pass
+
+
+class Stage:
+    # Rows a stage handled, and the seconds it sat idle waiting on its queues. Busy time is the rest of its wall time,
+    # of which cpu time is the time its thread ran, the remainder went waiting on I/O or other threads' GIL.
+    def __init__(self, stop):
+        self.stop = stop
+        self.rows = 0
+        self.idle = 0.0
+        self.start = self.end = None
+        self.cpu = 0.0
+
+    def begin(self):
+        # Called from the stage's own thread
+        self.start = time.perf_counter()
+        self.cpu = time.thread_time()
+
+    def get(self, source):
+        start = time.perf_counter()
+        while True:
+            try:
+                item = source.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self.stop.is_set():
+                    raise Stopped()
+        self.idle += time.perf_counter() - start
+        return item
+
+    def put(self, target, item):
+        start = time.perf_counter()
+        while True:
+            try:
+                target.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if self.stop.is_set():
+                    raise Stopped()
+        self.idle += time.perf_counter() - start
+
+    def finish(self):
+        self.end = time.perf_counter()
+        self.cpu = time.thread_time() - self.cpu
+
+    def report(self):
+        seconds = self.end - self.start
+        busy = max(seconds - self.idle, 0.0)
+        return {'rows': self.rows, 'seconds': round(seconds, 4), 'busy_seconds': round(busy, 4),
+                'cpu_seconds': round(self.cpu, 4), 'idle_seconds': round(self.idle, 4),
+                'idle_share': round(self.idle / seconds, 4) if seconds else None,
+                'rows_per_second': round(self.rows / busy, 1) if busy > 0 else None}
+
+
+def run(params, stats):
+    # Reads, calculates and writes at the same time: a reader thread fills a bounded queue with chunks of csv rows,
+    # this thread casts and calculates them into chunks of output rows, and a writer thread drains those through
+    # csv.writer. Output matches writer.write_data. stats['pipeline'] gets each stage's Stage.report().
+    header, rows = reader.stream_data(params)
+    type_selector, converters = reader.validate_data_format(params['data_params'], header)
+    out_header = header + methods.OUT_KEYS
+    stop = threading.Event()
+    errors = []
+    row_chunks = queue.Queue(QUEUE_CHUNKS)
+    out_chunks = queue.Queue(QUEUE_CHUNKS)
+    stages = dict((name, Stage(stop)) for name in STAGES)
+    threads = [threading.Thread(target=_run_stage, args=(read_chunks, (rows, row_chunks), stages['read'], errors),
+                                daemon=True),
+               threading.Thread(target=_run_stage, args=(write_chunks, (out_chunks, out_header, params),
+                                                         stages['write'], errors), daemon=True)]
+    for thread in threads:
+        thread.start()
+    stages['calculate'].begin()
+    try:
+        surveys = data_processor.calculate_surveys(
+            data_processor.decode_rows(iter_chunks(row_chunks, stages['calculate']), header, params, stats),
+            params, stats)
+        if 'rollup' in params:
+            surveys = data_processor.rollup_surveys(surveys, stats)
+        calculate_chunks(surveys, out_header, out_chunks, stages['calculate'])
+    except Stopped:
+        pass
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        stages['calculate'].finish()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    stats['pipeline'] = dict((name, stage.report()) for name, stage in stages.items())
+    return stats
+
+
+def _run_stage(function, args, stage, errors):
+    # Runs a thread's stage, keeping its exception for the calculate stage to raise and stopping the other stages
+    stage.begin()
+    try:
+        function(*args, stage)
+    except Stopped:
+        pass
+    except BaseException as error:
+        errors.append(error)
+        stage.stop.set()
+    finally:
+        stage.finish()
+
+
+def read_chunks(rows, row_chunks, stage):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_ROWS:
+            stage.put(row_chunks, chunk)
+            stage.rows += len(chunk)
+            chunk = []
+    if chunk:
+        stage.put(row_chunks, chunk)
+        stage.rows += len(chunk)
+    stage.put(row_chunks, None)
+
+
+def iter_chunks(row_chunks, stage):
+    # The rows of the reader's chunks, until its closing None
+    while True:
+        chunk = stage.get(row_chunks)
+        if chunk is None:
+            return
+        yield from chunk
+
+
+def calculate_chunks(surveys, out_header, out_chunks, stage):
+    # Projects each survey onto out_header as write_data does, '' for the keys a survey does not have
+    chunk = []
+    for survey in surveys:
+        chunk.append(writer.project(survey, out_header))
+        if len(chunk) == CHUNK_ROWS:
+            stage.put(out_chunks, chunk)
+            stage.rows += len(chunk)
+            chunk = []
+    if chunk:
+        stage.put(out_chunks, chunk)
+        stage.rows += len(chunk)
+    stage.put(out_chunks, None)
+
+
+def write_chunks(out_chunks, out_header, params, stage):
+    with writer.open_output(params) as (out_file, lineterminator):
+        _write_chunks(csv.writer(out_file, lineterminator=lineterminator), out_chunks, out_header, stage)
+        out_file.flush()
+
+
+def _write_chunks(csv_writer, out_chunks, out_header, stage):
+    csv_writer.writerow(out_header)
+    while True:
+        chunk = stage.get(out_chunks)
+        if chunk is None:
+            return
+        csv_writer.writerows(chunk)
+        stage.rows += len(chunk)
+
+
+def format_stages(report):
+    # One logfile line per stage of a stats['pipeline'] report
+    return ['Pipeline %s: %s rows, %s rows/s busy, %s cpu seconds, idle %s of %s seconds' % (
+        name, stage['rows'], stage['rows_per_second'], stage['cpu_seconds'], stage['idle_seconds'], stage['seconds'])
+        for name, stage in report.items()]
@@ -4,6 +4,7 @@ import os
 import csv
 import json
 import logging
+import compressed
 
 
 def create_typer(datetime_format):
@@ -20,24 +21,25 @@ def create_typer(datetime_format):
 def get_data(params):
     if not sys.stdin.isatty():
         logging.debug('Reading stdin')
-        data_stream = sys.stdin
+        data_stream = compressed.read_stdin(sys.stdin, compressed.params_options(params)[2])
         csv_reader = load_stdin(data_stream)
         header, raw_data = read_file(csv_reader)
     else:
         logging.debug('Reading from file')
-        csv_file, data_stream = load_csv(params['filepath'])
+        csv_file, data_stream = load_csv(params['filepath'], compressed.params_options(params)[2])
         header, raw_data = read_file(data_stream)
         csv_file.close()
     return header, raw_data
 
 
-def load_csv(file_location):
-    if not file_location.lower().endswith('.csv'):
+def load_csv(file_location, buffer_size=None):
+    # Also reads gzip, bz2 and xz compressed csvs (e.g. register.csv.gz), detected by their magic bytes
+    if not compressed.strip_extension(file_location).lower().endswith('.csv'):
         raise ValueError('File: {file_location} is not a csv'.format(file_location=file_location))
     if not os.path.exists(file_location):
         raise FileNotFoundError('{f} Not Found'.format(f=file_location))
 
-    csv_file = open(file_location, encoding='UTF-8'.lower())
+    csv_file = compressed.open_text(file_location, encoding='UTF-8'.lower(), buffer_size=buffer_size)
     csv_reader = csv.reader(csv_file, delimiter=',')
     return csv_file, csv_reader
 
@@ -47,22 +49,39 @@ def load_stdin(std):
     return csv_reader
 
 
-def read_file(csv_reader):
-    raw_data = []
-    line_count = 0
+def stream_data(params):
+    # Streaming form of get_data, rows are only read from the file or stdin as the returned iterator is consumed
+    if not sys.stdin.isatty():
+        logging.debug('Streaming stdin')
+        header, rows = iter_file(load_stdin(compressed.read_stdin(sys.stdin, compressed.params_options(params)[2])))
+    else:
+        logging.debug('Streaming from file')
+        csv_file, data_stream = load_csv(params['filepath'], compressed.params_options(params)[2])
+        header, rows = iter_file(data_stream, csv_file)
+    return header, rows
+
+
+def iter_file(csv_reader, csv_file=None):
     header = []
-    for row in csv_reader:
-        if line_count == 0:
-            if any(cell.isdigit() for cell in row):  # Top row is not header
-                raw_data.append(row.strip('\n'))
-            else:
-                header = row
-            line_count += 1
-        else:
-            raw_data.append(row)
-            line_count += 1
-
-    logging.debug(f'Read {line_count} lines.')
+    first_row = next(csv_reader, None)
+    if first_row is not None and not any(cell.isdigit() for cell in first_row):
+        header = first_row
+        first_row = None
+    return header, _iter_rows(csv_reader, first_row, csv_file)
+
+
+def _iter_rows(csv_reader, first_row, csv_file):
+    if first_row is not None:  # Top row is not header
+        yield first_row
+    yield from csv_reader
+    if csv_file is not None:
+        csv_file.close()
+
+
+def read_file(csv_reader):
+    header, rows = iter_file(csv_reader)
+    raw_data = list(rows)
+    logging.debug(f'Read {len(raw_data) + (1 if header else 0)} lines.')
     return header, raw_data
 
 
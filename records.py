@@ -0,0 +1,59 @@
+import keyword
+import methods
+
+_record_types = {}
+
+
+class SurveyRecord:
+    # Base for the compact survey records made by make_record_type. Records keep their fields in __slots__
+    # instead of a per-row dict, and support the dict access hvirCalculator and writer.write_data use.
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.keys()}
+
+    @classmethod
+    def from_dict(cls, survey):
+        record = cls.__new__(cls)
+        for key, value in survey.items():
+            record[key] = value
+        return record
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.to_dict())
+
+
+def make_record_type(settings, base_fields=()):
+    # Generates a SurveyRecord class with a slot for each of base_fields, the config datatypes and the result
+    # keys, in that order
+    fields = list(base_fields)
+    fields += [key for key in settings['datatypes'] if key not in fields]
+    fields += [key for key in methods.OUT_KEYS if key not in fields]
+    key = tuple(fields)
+    if key not in _record_types:
+        for field in fields:
+            if not field.isidentifier() or keyword.iskeyword(field) or hasattr(SurveyRecord, field):
+                raise ValueError('Column name %s can not be used as a record field' % field)
+        _record_types[key] = type('SurveyRecord', (SurveyRecord,), {'__slots__': key})
+    return _record_types[key]
@@ -0,0 +1,131 @@
+import json
+import numpy as np
+import column_cache
+import data_processor
+import methods
+import reader
+
+A_METHODS = ['limits', 'avc']
+R_METHODS = ['iri', 'hati']
+CHUNK_ROWS = 65536
+
+
+def parse_scenarios(spec):
+    # 'all' or a comma separated list of a_method:r_method pairs, e.g. limits:iri,avc:hati
+    if spec in ('', 'all'):
+        return [(a_method, r_method) for a_method in A_METHODS for r_method in R_METHODS]
+    pairs = []
+    for pair in spec.split(','):
+        a_method, r_method = pair.strip().split(':')
+        if a_method not in A_METHODS or r_method not in R_METHODS:
+            raise ValueError('Invalid scenario %s, a method must be one of %s and r method one of %s'
+                             % (pair, A_METHODS, R_METHODS))
+        pairs.append((a_method, r_method))
+    return pairs
+
+
+def load_defaults(params):
+    # Named default_values blocks from the --defaults json file, otherwise the config's own block
+    if 'defaults_file' not in params:
+        return {'': params['data_params']['default_values']}
+    with open(params['defaults_file']) as json_file:
+        return json.load(json_file)
+
+
+def scenario_names(pairs, defaults):
+    names = []
+    for defaults_name in defaults:
+        for a_method, r_method in pairs:
+            suffix = '%s_%s' % (a_method, r_method) + ('_%s' % defaults_name if defaults_name else '')
+            names.append((suffix, a_method, r_method, defaults_name))
+    return names
+
+
+def out_keys(names, defaults):
+    keys = ['w']
+    for defaults_name in defaults:
+        suffix = '_%s' % defaults_name if defaults_name else ''
+        keys += ['minev' + suffix, 'maxev' + suffix]
+    for suffix, a_method, r_method, defaults_name in names:
+        keys += ['a_' + suffix, 'r_' + suffix, 'hvir_' + suffix, 'cat_' + suffix]
+    return keys
+
+
+def evaluate(calculator, columns, names, defaults):
+    # Evaluates every scenario on one chunk of columns. w is shared by all scenarios, a, r and the ev bands are
+    # computed once per method and default_values block. Returns the result arrays keyed by output column.
+    n = len(columns['road_cat'])
+    w_failed = np.zeros(n, dtype=bool)
+    results = {'w': calculator.w_method_batch(columns, w_failed)}
+    a_values, r_values, ev_values = {}, {}, {}
+    for defaults_name, default_values in defaults.items():
+        calculator.defaults = default_values
+        suffix = '_%s' % defaults_name if defaults_name else ''
+        ev_values[defaults_name] = (calculator.calc_ev_batch(columns['road_cat'], default_values['minev']),
+                                    calculator.calc_ev_batch(columns['road_cat'], default_values['maxev']))
+        results['minev' + suffix], results['maxev' + suffix] = ev_values[defaults_name]
+        for a_method in A_METHODS:
+            failed = np.zeros(n, dtype=bool)
+            a = calculator.a_method_batch(columns, {'a_method': a_method}, failed)
+            a_values[a_method, defaults_name] = a, failed
+        for r_method in R_METHODS:
+            failed = np.zeros(n, dtype=bool)
+            r = calculator.r_method_batch(columns, {'r_method': r_method}, failed)
+            r_values[r_method, defaults_name] = r, failed
+    for suffix, a_method, r_method, defaults_name in names:
+        a, a_failed = a_values[a_method, defaults_name]
+        r, r_failed = r_values[r_method, defaults_name]
+        minev, maxev = ev_values[defaults_name]
+        failed = w_failed | a_failed | r_failed
+        hvir = calculator.calc_hvir_batch(a, r, results['w'], failed)
+        cat = calculator.calc_cat_batch(columns['road_cat'], hvir, minev, maxev, failed)
+        cat[failed] = 'NA'
+        results['a_' + suffix] = np.where(failed, np.nan, a)
+        results['r_' + suffix] = np.where(failed, np.nan, r)
+        results['hvir_' + suffix] = np.where(failed, np.nan, hvir)
+        results['cat_' + suffix] = cat
+    return results
+
+
+def iter_surveys(numbered_surveys, names, defaults, keys):
+    # Evaluates the scenarios chunk by chunk and yields the surveys with the scenario columns added, NA for
+    # results a scenario could not calculate
+    calculator = methods.hvirCalculator()
+    chunk = []
+    for row_num, survey in numbered_surveys:
+        chunk.append(survey)
+        if len(chunk) == CHUNK_ROWS:
+            yield from _evaluate_chunk(calculator, chunk, names, defaults, keys)
+            chunk = []
+    yield from _evaluate_chunk(calculator, chunk, names, defaults, keys)
+
+
+def _evaluate_chunk(calculator, chunk, names, defaults, keys):
+    if not chunk:
+        return
+    results = evaluate(calculator, methods.columns_from_surveys(chunk), names, defaults)
+    columns = [[value if value == value else 'NA' for value in results[key].tolist()] for key in keys]
+    for survey, values in zip(chunk, zip(*columns)):
+        for key, value in zip(keys, values):
+            survey[key] = value
+        yield survey
+
+
+def run(params):
+    # Reads and casts the register once (or loads it from the --cache column cache) and evaluates all scenarios
+    defaults = load_defaults(params)
+    names = scenario_names(parse_scenarios(params['scenarios']), defaults)
+    keys = out_keys(names, defaults)
+    if 'column_cache' in params:
+        cache = column_cache.open_cache(params['column_cache'], column_cache.source_location(params),
+                                        params['data_params'])
+        header = cache['meta']['header']
+        stats = column_cache.new_stats(cache)
+        numbered_surveys = column_cache.iter_surveys(cache)
+    else:
+        header, rows = reader.stream_data(params)
+        reader.validate_data_format(params['data_params'], header)
+        stats = data_processor.new_stats()
+        # The scenario columns are added to the surveys, which --compact records have no slots for
+        numbered_surveys = data_processor.decode_rows(rows, header, params, stats, compact=False)
+    return header + keys, iter_surveys(numbered_surveys, names, defaults, keys), stats
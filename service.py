@@ -0,0 +1,267 @@
+import asyncio
+import collections
+import csv
+import getopt
+import io
+import json
+import sys
+import time
+import urllib.parse
+import data_processor
+import methods
+import reader
+import scenarios
+
+# Result columns returned for each row, with the row's unique_id when the batch has one
+RESULT_KEYS = ['a', 'r', 'w', 'hvir', 'cat', 'failed']
+CSV_TYPE = 'text/csv'
+JSON_LINES_TYPE = 'application/x-ndjson'
+MAX_BODY_BYTES = 64 * 1024 * 1024
+LATENCY_SAMPLES = 10000
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large'}
+
+
+def get_params(argv):
+    arg_keys = {'c': 'config_file',
+                'a': 'a_method',
+                'r': 'r_method',
+                'socket': 'socket',
+                'host': 'host',
+                'port': 'port'}
+
+    params = {'config_file': 'config/settings.config',
+              'a_method': 'limits',
+              'r_method': 'iri',
+              'host': '127.0.0.1',
+              'port': '8765'}
+    try:
+        opts, args = getopt.getopt(argv, 'c:a:r:', ['socket=', 'host=', 'port='])
+        for key, value in opts:
+            params[arg_keys[key.strip('-')]] = value
+    except getopt.GetoptError:
+        print('Usage: python service.py [-c config] [-a a_method] [-r r_method] [--socket path | --port port]')
+        sys.exit(2)
+    return params
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Metrics:
+    # Request counts and a window of the latest request latencies, served as json on GET /metrics
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.rows = 0
+        self.connections = 0
+        self.busy_seconds = 0.0
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, seconds, rows, error=False):
+        self.requests += 1
+        self.errors += error
+        self.rows += rows
+        self.busy_seconds += seconds
+        self.latencies.append(seconds)
+
+    def report(self):
+        uptime = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+        report = {'uptime_seconds': round(uptime, 3),
+                  'requests': self.requests,
+                  'errors': self.errors,
+                  'rows': self.rows,
+                  'open_connections': self.connections,
+                  'requests_per_second': round(self.requests / uptime, 2),
+                  'rows_per_second': round(self.rows / uptime, 1),
+                  'busy_rows_per_second': round(self.rows / self.busy_seconds, 1) if self.busy_seconds else None,
+                  'latency_ms': None}
+        if latencies:
+            report['latency_ms'] = {name: round(latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000, 3)
+                                    for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.0))}
+        return report
+
+
+class Service:
+    # Loads the config once and calculates batches of survey rows with hvirCalculator.method_logic_batch.
+    # Requests are small HTTP/1.1 messages, over a unix socket or localhost tcp:
+    #   POST /calculate[?a=avc&r=hati]  body: csv with a header row (text/csv) or json lines (application/x-ndjson)
+    #   GET /metrics                     request counts, throughput and latency percentiles
+    def __init__(self, params):
+        self.params = params
+        self.settings, type_dict = reader.get_data_settings(params['config_file'])
+        self.calculator = methods.hvirCalculator()
+        self.metrics = Metrics()
+
+    def calculate(self, header, rows, a_method=None, r_method=None):
+        # Returns the RESULT_KEYS values of each row, a row that can not be read or calculated has failed set
+        # and NA (None) results
+        try:
+            reader.validate_data_format(self.settings, header)
+        except KeyError as error:
+            raise RequestError(400, str(error))
+        decode = data_processor.compile_decoder(header, self.settings)
+        key_fails = {}
+        surveys = []
+        unreadable = []
+        for row_num, row in enumerate(rows):
+            try:
+                surveys.append(decode(row, key_fails))
+            except Exception:
+                surveys.append({})
+                unreadable.append(row_num)
+        hvir_params = {'a_method': a_method or self.params['a_method'],
+                       'r_method': r_method or self.params['r_method'],
+                       'data_params': self.settings}
+        results = self.calculator.method_logic_batch(methods.columns_from_surveys(surveys), hvir_params)
+        results['failed'][unreadable] = True
+        columns = [[None if value != value or value == 'NA' else value for value in results[key].tolist()]
+                   for key in RESULT_KEYS[:-1]]
+        columns.append(results['failed'].tolist())
+        ids = [survey.get('unique_id') for survey in surveys] if 'unique_id' in header else None
+        return ids, list(zip(*columns))
+
+    def calculate_csv(self, body, query):
+        csv_reader = csv.reader(io.StringIO(body.decode('utf-8'), newline=''))
+        try:
+            header = next(csv_reader, [])
+            rows = list(csv_reader)
+        except csv.Error as error:
+            raise RequestError(400, 'Invalid csv on line %s: %s' % (csv_reader.line_num, error))
+        ids, results = self.calculate(header, rows, *query)
+        out = io.StringIO()
+        csv_writer = csv.writer(out, lineterminator='\n')
+        csv_writer.writerow((['unique_id'] if ids is not None else []) + RESULT_KEYS)
+        for row_num, values in enumerate(results):
+            values = ['NA' if value is None else value for value in values[:-1]] + [int(values[-1])]
+            csv_writer.writerow(([ids[row_num]] if ids is not None else []) + values)
+        return len(rows), CSV_TYPE, out.getvalue().encode('utf-8')
+
+    def calculate_json_lines(self, body, query):
+        # Each line is an object of column values, cast from their text the same way as csv cells
+        try:
+            objects = [json.loads(line) for line in body.decode('utf-8').splitlines() if line.strip()]
+        except ValueError as error:
+            raise RequestError(400, 'Invalid json line: %s' % error)
+        for line_num, survey in enumerate(objects):
+            if not isinstance(survey, dict):
+                raise RequestError(400, 'Json line %s is not an object' % (line_num + 1))
+        header = list(dict.fromkeys(key for survey in objects for key in survey))
+        rows = [[_cell(survey.get(key)) for key in header] for survey in objects]
+        ids, results = self.calculate(header, rows, *query)
+        lines = []
+        for row_num, values in enumerate(results):
+            result = dict(zip(RESULT_KEYS, values))
+            if ids is not None:
+                result = dict(unique_id=ids[row_num], **result)
+            lines.append(json.dumps(result) + '\n')
+        return len(rows), JSON_LINES_TYPE, ''.join(lines).encode('utf-8')
+
+    def respond(self, method, target, headers, body):
+        # Returns (rows, status, content type, payload)
+        url = urllib.parse.urlsplit(target)
+        if url.path == '/metrics':
+            if method != 'GET':
+                raise RequestError(405, 'Use GET for /metrics')
+            return 0, 200, 'application/json', json.dumps(self.metrics.report()).encode('utf-8')
+        if url.path != '/calculate':
+            raise RequestError(404, 'Unknown path %s' % url.path)
+        if method != 'POST':
+            raise RequestError(405, 'Use POST for /calculate')
+        query = urllib.parse.parse_qs(url.query)
+        methods_query = (query.get('a', [None])[0], query.get('r', [None])[0])
+        for name, value, choices in (('a', methods_query[0], scenarios.A_METHODS),
+                                     ('r', methods_query[1], scenarios.R_METHODS)):
+            if value is not None and value not in choices:
+                raise RequestError(400, 'Unknown %s method %s, use one of %s' % (name, value, ', '.join(choices)))
+        content_type = headers.get('content-type', CSV_TYPE).split(';')[0].strip()
+        if content_type in (JSON_LINES_TYPE, 'application/jsonl', 'application/json'):
+            rows, content_type, payload = self.calculate_json_lines(body, methods_query)
+        else:
+            rows, content_type, payload = self.calculate_csv(body, methods_query)
+        return rows, 200, content_type, payload
+
+    async def handle(self, stream_reader, stream_writer):
+        # One connection, kept alive for further requests unless the client asks to close it
+        self.metrics.connections += 1
+        try:
+            while True:
+                request_line = await stream_reader.readline()
+                if not request_line.strip():
+                    break
+                start = time.perf_counter()
+                keep_alive = True
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                    headers = await read_headers(stream_reader)
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                    length = int(headers.get('content-length', 0))
+                    if length > MAX_BODY_BYTES:
+                        keep_alive = False
+                        raise RequestError(413, 'Request body over %s bytes' % MAX_BODY_BYTES)
+                    body = await stream_reader.readexactly(length)
+                    # Calculated on an executor thread, so other connections are served meanwhile
+                    rows, status, content_type, payload = await asyncio.get_running_loop().run_in_executor(
+                        None, self.respond, method, target, headers, body)
+                except RequestError as error:
+                    rows, status, content_type, payload = 0, error.status, 'text/plain', str(error).encode('utf-8')
+                except (ValueError, UnicodeDecodeError) as error:
+                    keep_alive = False
+                    rows, status, content_type, payload = 0, 400, 'text/plain', str(error).encode('utf-8')
+                stream_writer.write(('HTTP/1.1 %s %s\r\nContent-Type: %s\r\nContent-Length: %s\r\n%s\r\n' % (
+                    status, STATUS_TEXT[status], content_type, len(payload),
+                    '' if keep_alive else 'Connection: close\r\n')).encode('latin-1') + payload)
+                await stream_writer.drain()
+                self.metrics.record(time.perf_counter() - start, rows, status != 200)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.metrics.connections -= 1
+            stream_writer.close()
+
+    async def serve(self):
+        if 'socket' in self.params:
+            server = await asyncio.start_unix_server(self.handle, path=self.params['socket'])
+            print('Serving on %s' % self.params['socket'], file=sys.stderr)
+        else:
+            server = await asyncio.start_server(self.handle, host=self.params['host'], port=int(self.params['port']))
+            print('Serving on http://%s:%s' % (self.params['host'], self.params['port']), file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+async def read_headers(stream_reader):
+    headers = {}
+    while True:
+        line = await stream_reader.readline()
+        if not line.strip():
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value)
+
+
+def main():
+    service = Service(get_params(sys.argv[1:]))
+    try:
+        asyncio.run(service.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
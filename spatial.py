@@ -0,0 +1,241 @@
+import csv
+import getopt
+import json
+import math
+import os
+import sys
+import numpy as np
+import compressed
+
+# Bump when the on-disk layout changes
+INDEX_VERSION = 2
+DEFAULT_CELL_SIZE = 0.01  # degrees
+# Segments whose bounding box covers more cells than this are not gridded, but kept in an overflow list that
+# every query scans
+DEFAULT_MAX_CELLS = 64
+COORDINATES = ['start_long', 'start_lat', 'end_long', 'end_lat']
+# Result columns kept for each segment when the csv has them
+RESULT_COLUMNS = ['unique_id', 'road_cat', 'cat', 'a', 'r', 'w']
+NUMERIC_COLUMNS = ['a', 'r', 'w']
+METRES_PER_DEGREE = 111320.0
+
+
+def build(results_location, index_dir, cell_size=DEFAULT_CELL_SIZE, max_cells=DEFAULT_MAX_CELLS):
+    # Indexes the segments of a results csv (main.py output, or any csv with the COORDINATES columns) on a grid
+    # of cell_size degree cells and saves it to index_dir. Rows with missing or unreadable coordinates are skipped.
+    with compressed.open_text(results_location, encoding='utf-8', newline='') as csv_file:
+        csv_reader = csv.reader(csv_file)
+        header = next(csv_reader, [])
+        missing = [name for name in COORDINATES if name not in header]
+        if missing:
+            raise KeyError('%s has no %s column(s)' % (results_location, ', '.join(missing)))
+        coordinate_index = [header.index(name) for name in COORDINATES]
+        result_index = {name: header.index(name) for name in RESULT_COLUMNS if name in header}
+        coordinates = []
+        results = {name: [] for name in result_index}
+        skipped = 0
+        for row in csv_reader:
+            try:
+                segment = [float(row[index]) for index in coordinate_index]
+            except (ValueError, IndexError):
+                skipped += 1
+                continue
+            if not all(math.isfinite(value) for value in segment):
+                skipped += 1
+                continue
+            coordinates.append(segment)
+            for name, index in result_index.items():
+                results[name].append(row[index] if index < len(row) else '')
+    coordinates = np.array(coordinates, dtype=float).reshape(-1, 4)
+    boxes = np.column_stack([np.minimum(coordinates[:, 0], coordinates[:, 2]),
+                             np.minimum(coordinates[:, 1], coordinates[:, 3]),
+                             np.maximum(coordinates[:, 0], coordinates[:, 2]),
+                             np.maximum(coordinates[:, 1], coordinates[:, 3])])
+    origin = [float(boxes[:, 0].min()), float(boxes[:, 1].min())] if len(boxes) else [0.0, 0.0]
+    cells = np.floor((boxes - (origin + origin)) / cell_size).astype(np.int64)
+    spans = (cells[:, 2] - cells[:, 0] + 1) * (cells[:, 3] - cells[:, 1] + 1)
+    overflow = np.flatnonzero(spans > max_cells)
+    gridded = np.flatnonzero(spans <= max_cells)
+    nx = int(cells[gridded, 2].max()) + 1 if len(gridded) else 1
+    ny = int(cells[gridded, 3].max()) + 1 if len(gridded) else 1
+    cell_keys, cell_offsets, cell_items = _grid(cells[gridded], nx)
+    cell_items = gridded[cell_items]
+
+    os.makedirs(index_dir, exist_ok=True)
+    meta_location = os.path.join(index_dir, 'meta.json')
+    if os.path.exists(meta_location):
+        os.remove(meta_location)
+    arrays = {'coordinates': coordinates, 'boxes': boxes, 'cell_keys': cell_keys, 'cell_offsets': cell_offsets,
+              'cell_items': cell_items, 'overflow': overflow}
+    for name, values in results.items():
+        if name in NUMERIC_COLUMNS:
+            arrays[name] = np.array([_number(value) for value in values], dtype=float)
+        else:
+            arrays[name] = np.array(values or [''], dtype=str)[:len(values)]
+    for name, values in arrays.items():
+        np.save(os.path.join(index_dir, name + '.npy'), values)
+    meta = {'version': INDEX_VERSION, 'source': results_location, 'cell_size': cell_size, 'origin': origin,
+            'nx': nx, 'ny': ny, 'segments': len(coordinates), 'skipped': skipped, 'max_cells': max_cells,
+            'overflow': len(overflow), 'columns': list(results)}
+    with open(meta_location, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    return SpatialIndex(index_dir)
+
+
+def _grid(cells, nx):
+    # Sorted occupied cell keys (row * nx + column), and for each the range of cell_items (segment numbers) in
+    # it. A segment is listed in every cell its bounding box touches.
+    widths = cells[:, 2] - cells[:, 0] + 1
+    spans = widths * (cells[:, 3] - cells[:, 1] + 1)
+    segments = np.repeat(np.arange(len(cells)), spans)
+    position = np.arange(len(segments)) - np.repeat(np.cumsum(spans) - spans, spans)
+    keys = ((np.repeat(cells[:, 1], spans) + position // np.repeat(widths, spans)) * nx +
+            np.repeat(cells[:, 0], spans) + position % np.repeat(widths, spans))
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    cell_keys, starts = np.unique(keys, return_index=True)
+    return cell_keys, np.append(starts, len(keys)).astype(np.int64), segments[order]
+
+
+def _number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+class SpatialIndex:
+    # Bounding box and nearest segment queries over an index saved by build, the arrays are memory-mapped
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, 'meta.json')) as meta_file:
+            self.meta = json.load(meta_file)
+        if self.meta['version'] != INDEX_VERSION:
+            raise ValueError('%s was built by another version, rebuild it' % index_dir)
+        self.arrays = {}
+        arrays = ['coordinates', 'boxes', 'cell_keys', 'cell_offsets', 'cell_items', 'overflow']
+        for name in arrays + self.meta['columns']:
+            self.arrays[name] = np.load(os.path.join(index_dir, name + '.npy'), mmap_mode='r')
+        self.cell_size = self.meta['cell_size']
+        self.origin = self.meta['origin']
+
+    def __len__(self):
+        return self.meta['segments']
+
+    def _cell(self, long, lat):
+        return (int(math.floor((long - self.origin[0]) / self.cell_size)),
+                int(math.floor((lat - self.origin[1]) / self.cell_size)))
+
+    def _candidates(self, cx0, cy0, cx1, cy1):
+        # Segment numbers listed in the cells of the column and row range, clipped to the grid, and the overflow
+        # segments
+        nx, ny = self.meta['nx'], self.meta['ny']
+        cx0, cy0, cx1, cy1 = max(cx0, 0), max(cy0, 0), min(cx1, nx - 1), min(cy1, ny - 1)
+        chunks = [self.arrays['overflow']]
+        if cx0 <= cx1 and cy0 <= cy1:
+            rows = np.arange(cy0, cy1 + 1, dtype=np.int64) * nx
+            keys, offsets, items = self.arrays['cell_keys'], self.arrays['cell_offsets'], self.arrays['cell_items']
+            starts = offsets[np.searchsorted(keys, rows + cx0, 'left')]
+            stops = offsets[np.searchsorted(keys, rows + cx1, 'right')]
+            chunks += [items[start:stop] for start, stop in zip(starts.tolist(), stops.tolist()) if stop > start]
+        return np.unique(np.concatenate(chunks).astype(np.int64))
+
+    def bbox_ids(self, min_long, min_lat, max_long, max_lat):
+        # Segment numbers whose bounding box intersects the query box
+        cx0, cy0 = self._cell(min_long, min_lat)
+        cx1, cy1 = self._cell(max_long, max_lat)
+        candidates = self._candidates(cx0, cy0, cx1, cy1)
+        boxes = self.arrays['boxes'][candidates]
+        inside = ((boxes[:, 0] <= max_long) & (boxes[:, 2] >= min_long) &
+                  (boxes[:, 1] <= max_lat) & (boxes[:, 3] >= min_lat))
+        return candidates[inside]
+
+    def nearest_ids(self, long, lat, k=10):
+        # (segment numbers, distances in metres) of the k segments nearest the point, by equirectangular distance
+        # from the point to each segment. The searched square of cells doubles until it holds k segments that are
+        # nearer than its edge.
+        cx, cy = self._cell(long, lat)
+        metres_x = METRES_PER_DEGREE * math.cos(math.radians(lat))
+        nx, ny = self.meta['nx'], self.meta['ny']
+        grid_cells = max(nx, ny) + abs(cx) + abs(cy)
+        # Points off the grid start from the square that reaches it
+        radius = max(1, -cx, cx - nx + 1, -cy, cy - ny + 1)
+        while True:
+            candidates = self._candidates(cx - radius, cy - radius, cx + radius, cy + radius)
+            distances = _distances(self.arrays['coordinates'][candidates], long, lat, metres_x)
+            order = np.argsort(distances, kind='stable')[:k]
+            reach = radius * self.cell_size * min(metres_x, METRES_PER_DEGREE)
+            if (len(order) == k and distances[order[-1]] <= reach) or radius > grid_cells:
+                return candidates[order], distances[order]
+            radius *= 2
+
+    def segments(self, ids, distances=None):
+        # Dicts of the coordinates and result columns of the given segment numbers
+        ids = np.asarray(ids, dtype=np.int64)
+        columns = {name: self.arrays['coordinates'][ids, index].tolist() for index, name in enumerate(COORDINATES)}
+        for name in self.meta['columns']:
+            values = self.arrays[name][ids].tolist()
+            columns[name] = [None if value != value else value for value in values]
+        if distances is not None:
+            columns['distance_m'] = np.round(distances, 2).tolist()
+        names = [name for name in RESULT_COLUMNS if name in columns] + COORDINATES + (
+            ['distance_m'] if distances is not None else [])
+        return [dict(zip(names, values)) for values in zip(*[columns[name] for name in names])]
+
+    def bbox(self, min_long, min_lat, max_long, max_lat):
+        return self.segments(self.bbox_ids(min_long, min_lat, max_long, max_lat))
+
+    def nearest(self, long, lat, k=10):
+        return self.segments(*self.nearest_ids(long, lat, k))
+
+
+def _distances(coordinates, long, lat, metres_x):
+    # Distance in metres from the point to each segment, on a local equirectangular projection
+    start_x = (coordinates[:, 0] - long) * metres_x
+    start_y = (coordinates[:, 1] - lat) * METRES_PER_DEGREE
+    dx = (coordinates[:, 2] - coordinates[:, 0]) * metres_x
+    dy = (coordinates[:, 3] - coordinates[:, 1]) * METRES_PER_DEGREE
+    length_2 = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.clip(np.where(length_2 > 0, -(start_x * dx + start_y * dy) / length_2, 0.0), 0.0, 1.0)
+    return np.hypot(start_x + t * dx, start_y + t * dy)
+
+
+def write_segments(segments, out_file):
+    if not segments:
+        return
+    writer = csv.DictWriter(out_file, fieldnames=list(segments[0]), lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(segments)
+
+
+def main():
+    # Options come before the coordinates, which may be negative
+    # python spatial.py build -f results.csv -i index_dir [--cell 0.01] [--max-cells 64]
+    # python spatial.py bbox -i index_dir min_long min_lat max_long max_lat
+    # python spatial.py nearest -i index_dir [-k 10] long lat
+    usage = ('Usage: python spatial.py build -f results.csv -i index_dir [--cell degrees] [--max-cells cells] | '
+             'bbox -i index_dir min_long min_lat max_long max_lat | nearest -i index_dir [-k count] long lat')
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], 'f:i:k:', ['cell=', 'max-cells='])
+        opts = dict(opts)
+        coordinates = [float(value) for value in args]
+    except (getopt.GetoptError, ValueError):
+        opts, coordinates = {}, []
+    if '-i' not in opts or not ((command == 'build' and '-f' in opts) or (command == 'bbox' and len(coordinates) == 4)
+                                or (command == 'nearest' and len(coordinates) == 2)):
+        print(usage)
+        sys.exit(2)
+    if command == 'build':
+        index = build(opts['-f'], opts['-i'], float(opts.get('--cell', DEFAULT_CELL_SIZE)),
+                      int(opts.get('--max-cells', DEFAULT_MAX_CELLS)))
+        print('Indexed %s segments (%s in the overflow list), skipped %s rows without coordinates' % (
+            len(index), index.meta['overflow'], index.meta['skipped']), file=sys.stderr)
+    elif command == 'bbox':
+        write_segments(SpatialIndex(opts['-i']).bbox(*coordinates), sys.stdout)
+    else:
+        write_segments(SpatialIndex(opts['-i']).nearest(*coordinates, k=int(opts.get('-k', 10))), sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import copy
+import itertools
+import json
+import numpy as np
+import column_cache
+import data_processor
+import methods
+import reader
+
+# Grid keys in the order candidates are numbered, each a list of candidate values. thresholds entries are
+# {"name": ..., "maxev": {...}, "minev": {...}} band sets, maxev and minev entries are band tables. Band
+# tables only need the road categories they change, the rest come from the config's default_values.
+GRID_KEYS = ['default_avc', 'default_r_val', 'thresholds', 'maxev', 'minev']
+SWEEP_HEADER = ['candidate', 'default_avc', 'default_r_val', 'thresholds', 'maxev', 'minev', 'rows', 'high',
+                'medium', 'low', 'na', 'length', 'high_share', 'medium_share', 'low_share', 'na_share']
+CATS = ['high', 'medium', 'low', 'na']
+CHUNK_ROWS = 65536
+# Rows x candidates evaluated at once, bounds the memory of the broadcast band comparisons
+CHUNK_CELLS = 2 ** 21
+# Marks the a and r values that come from default_avc and default_r_val, a and r are never negative otherwise
+DEFAULT_MARK = -np.inf
+
+
+def load_grid(location):
+    with open(location) as json_file:
+        grid = json.load(json_file)
+    unknown = sorted(set(grid) - set(GRID_KEYS))
+    if unknown:
+        raise ValueError('Unknown sweep grid key(s) %s, a grid varies %s' % (', '.join(unknown), ', '.join(GRID_KEYS)))
+    return grid
+
+
+def make_candidates(grid, default_values):
+    # Every combination of the grid's values, as the default_values block the calculation would use and the
+    # changes from the config that describe it
+    candidates = []
+    for values in itertools.product(*[grid.get(key) or [None] for key in GRID_KEYS]):
+        default_avc, default_r_val, thresholds, maxev, minev = values
+        merged = copy.deepcopy(default_values)
+        changes = {'thresholds': '', 'maxev': {}, 'minev': {}}
+        if default_avc is not None:
+            merged['default_avc'] = default_avc
+        if default_r_val is not None:
+            merged['default_r_val'] = default_r_val
+        if thresholds is not None:
+            changes['thresholds'] = thresholds.get('name', '')
+            for band in ('maxev', 'minev'):
+                changes[band].update(_band_table(thresholds.get(band, {})))
+        if maxev is not None:
+            changes['maxev'].update(_band_table(maxev))
+        if minev is not None:
+            changes['minev'].update(_band_table(minev))
+        for band in ('maxev', 'minev'):
+            merged[band].update(changes[band])
+        candidates.append({'default_values': merged, 'changes': changes})
+    return candidates
+
+
+def _band_table(table):
+    # Road categories are looked up lower-cased, as calc_maxev and calc_minev do, so R3 and r3 are the same band
+    return dict((label.lower(), value) for label, value in table.items())
+
+
+class Sweep:
+    # Category counts and int_len per category of every candidate, added chunk by chunk. a, r and w are
+    # calculated once per chunk, hvir once per distinct default_avc and default_r_val pair, and the categories
+    # of all candidates sharing that pair are compared against their bands at once.
+    def __init__(self, candidates, hvir_params):
+        self.candidates = candidates
+        self.hvir_params = hvir_params
+        self.calculator = methods.hvirCalculator()
+        self.groups = {}
+        for index, candidate in enumerate(candidates):
+            defaults = candidate['default_values']
+            key = (defaults.get('default_avc'), defaults.get('default_r_val'))
+            self.groups.setdefault(key, []).append(index)
+        self.groups = {key: np.array(members) for key, members in self.groups.items()}
+        # Band matrices, a column per road category in any candidate's tables and a last one for the default
+        labels = sorted({label for candidate in candidates for band in ('maxev', 'minev')
+                         for label in candidate['default_values'][band] if label != 'default'})
+        self.band_columns = dict((label, float(column)) for column, label in enumerate(labels))
+        self.band_columns['default'] = float(len(labels))
+        self.bands = {}
+        for band in ('maxev', 'minev'):
+            self.bands[band] = np.array([[table.get(label, table['default']) for label in labels] + [table['default']]
+                                         for table in (candidate['default_values'][band] for candidate in candidates)],
+                                        dtype=float)
+        self.counts = np.zeros((len(candidates), len(CATS)), dtype=np.int64)
+        self.lengths = np.zeros((len(candidates), len(CATS)))
+
+    def add(self, columns, lengths):
+        calculator = self.calculator
+        calculator.defaults = {'default_avc': DEFAULT_MARK, 'default_r_val': DEFAULT_MARK}
+        base_failed = np.zeros(len(lengths), dtype=bool)
+        a = calculator.a_method_batch(columns, self.hvir_params, base_failed)
+        r = calculator.r_method_batch(columns, self.hvir_params, base_failed)
+        w = calculator.w_method_batch(columns, base_failed)
+        # calc_ev_batch over the band column numbers gives each row's column in the band matrices
+        band_column = calculator.calc_ev_batch(columns['road_cat'], self.band_columns).astype(np.int64)
+        is_r0 = np.equal(columns['road_cat'], 'r0')
+        step = max(1, CHUNK_CELLS // max(len(lengths), 1))
+        for (default_avc, default_r_val), members in self.groups.items():
+            failed = base_failed.copy()
+            hvir = calculator.calc_hvir_batch(_fill(a, default_avc, failed), _fill(r, default_r_val, failed), w,
+                                              failed)
+            for start in range(0, len(members), step):
+                self.add_cats(members[start:start + step], hvir, failed, band_column, is_r0, lengths)
+
+    def add_cats(self, members, hvir, failed, band_column, is_r0, lengths):
+        # calc_cat_batch for several candidates' bands at once, rows x candidates
+        maxev = self.bands['maxev'][members][:, band_column]
+        minev = self.bands['minev'][members][:, band_column]
+        na = failed | (~is_r0 & (np.isnan(hvir) | (minev >= maxev)))
+        above = hvir > maxev
+        high = above & ~is_r0 & ~na
+        medium = ((~above & (hvir >= minev)) | is_r0) & ~na
+        low = ~(high | medium | na)
+        for column, mask in enumerate((high, medium, low, na)):
+            self.counts[members, column] += np.count_nonzero(mask, axis=1)
+            self.lengths[members, column] += mask @ lengths
+
+    def rows(self):
+        for index, candidate in enumerate(self.candidates):
+            defaults, changes = candidate['default_values'], candidate['changes']
+            length = self.lengths[index].sum()
+            shares = [round(value / length, data_processor.ROLLUP_DIGITS) if length else ''
+                      for value in self.lengths[index].tolist()]
+            yield ([index, defaults.get('default_avc', ''), defaults.get('default_r_val', ''), changes['thresholds'],
+                    json.dumps(changes['maxev'], sort_keys=True) if changes['maxev'] else '',
+                    json.dumps(changes['minev'], sort_keys=True) if changes['minev'] else '',
+                    int(self.counts[index].sum())] + self.counts[index].tolist() +
+                   [round(length, data_processor.ROLLUP_DIGITS)] + shares)
+
+
+def _fill(values, default, failed):
+    # values with the marked defaults replaced, rows with no default to use fail as in method_logic
+    marked = values == DEFAULT_MARK
+    if default is None:
+        failed |= marked
+        return np.where(marked, np.nan, values)
+    return np.where(marked, default, values)
+
+
+def iter_chunks(params):
+    # (columns, int_len) chunks of the register, from the --cache column cache or the cast csv rows. Surveys
+    # without an int_len count with no length, as in the rollup.
+    if 'column_cache' in params:
+        cache = column_cache.open_cache(params['column_cache'], column_cache.source_location(params),
+                                        params['data_params'])
+        stats = column_cache.new_stats(cache)
+        columns = column_cache.batch_columns(cache)
+        n_rows = len(columns['road_cat'])
+        if 'int_len' in cache['columns']:
+            lengths = np.nan_to_num(column_cache.numbers(cache, 'int_len'))
+        else:
+            lengths = np.zeros(n_rows)
+        chunks = (({key: values[start:start + CHUNK_ROWS] for key, values in columns.items()},
+                   lengths[start:start + CHUNK_ROWS]) for start in range(0, n_rows, CHUNK_ROWS))
+        return chunks, stats
+    header, rows = reader.stream_data(params)
+    reader.validate_data_format(params['data_params'], header)
+    stats = data_processor.new_stats()
+    return _survey_chunks(data_processor.decode_rows(rows, header, params, stats)), stats
+
+
+def _survey_chunks(numbered_surveys):
+    chunk = []
+    for row_num, survey in numbered_surveys:
+        chunk.append(survey)
+        if len(chunk) == CHUNK_ROWS:
+            yield _chunk_columns(chunk)
+            chunk = []
+    if chunk:
+        yield _chunk_columns(chunk)
+
+
+def _chunk_columns(surveys):
+    lengths = np.fromiter((survey.get('int_len') or 0.0 for survey in surveys), dtype=float, count=len(surveys))
+    return methods.columns_from_surveys(surveys), lengths
+
+
+def run(params):
+    # Casts the register once (or loads it from the --cache column cache) and returns SWEEP_HEADER rows, one per
+    # candidate of the params['sweep'] grid, for the a and r methods of params
+    candidates = make_candidates(load_grid(params['sweep']), params['data_params']['default_values'])
+    sweep = Sweep(candidates, params)
+    chunks, stats = iter_chunks(params)
+    for columns, lengths in chunks:
+        sweep.add(columns, lengths)
+    return SWEEP_HEADER, list(sweep.rows()), stats
@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DATA = os.path.join(ROOT, 'data', 'test_data.csv')
+# Rows sampled from a benchmarks.generate register, runs of consecutive segments from many owners, roads and
+# sections, with some empty road_cat, seal_flag and line_mark cells
+REGISTER = os.path.join(ROOT, 'tests', 'data', 'register.csv')
+
+
+def run_main(*args, stdin=TEST_DATA, text=True):
+    # main.py reads the csv from stdin and writes the output to stdout
+    with open(stdin, 'rb') as stdin_file:
+        result = subprocess.run([sys.executable, 'main.py'] + list(args), stdin=stdin_file, capture_output=True,
+                                text=text, cwd=ROOT)
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    return result.stdout
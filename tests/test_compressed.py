@@ -0,0 +1,28 @@
+import bz2
+import gzip
+import lzma
+import os
+import tempfile
+import unittest
+from helpers import REGISTER, run_main
+
+MODULES = {'gzip': gzip, 'bz2': bz2, 'xz': lzma}
+
+
+class CompressedTest(unittest.TestCase):
+    def test_round_trips(self):
+        expected = run_main(stdin=REGISTER, text=False)
+        with open(REGISTER, 'rb') as csv_file:
+            register = csv_file.read()
+        with tempfile.TemporaryDirectory() as directory:
+            for codec, module in MODULES.items():
+                with self.subTest(codec=codec):
+                    location = os.path.join(directory, 'register.csv.' + codec)
+                    with open(location, 'wb') as compressed_file:
+                        compressed_file.write(module.compress(register))
+                    output = run_main('--compress', codec, stdin=location, text=False)
+                    self.assertEqual(module.decompress(output), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
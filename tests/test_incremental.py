@@ -0,0 +1,43 @@
+import collections
+import csv
+import os
+import tempfile
+import unittest
+from helpers import REGISTER, run_main
+
+
+def read_rows(location):
+    with open(location, newline='') as csv_file:
+        return list(csv.reader(csv_file))
+
+
+def write_rows(location, rows):
+    with open(location, 'w', newline='') as csv_file:
+        csv.writer(csv_file, lineterminator='\n').writerows(rows)
+
+
+class IncrementalTest(unittest.TestCase):
+    def test_previous_matches_full_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            previous, changed = os.path.join(directory, 'previous.csv'), os.path.join(directory, 'changed.csv')
+            delta = os.path.join(directory, 'delta.csv')
+            with open(previous, 'w', newline='') as previous_file:
+                previous_file.write(run_main(stdin=REGISTER))
+            header, *rows = read_rows(REGISTER)
+            calculated = {row[0] for row in read_rows(previous)[1:]}
+            iri, road_name = header.index('iri'), header.index('road_name')
+            ids = [n for n, row in enumerate(rows) if row[0] in calculated and row[iri]]
+            # A recalculated row, a row with only a non-calculation column changed, a removed row and a new row
+            rows[ids[0]][iri] = '%.2f' % (float(rows[ids[0]][iri]) + 1)
+            rows[ids[1]][road_name] += ' Extension'
+            rows.append([rows[ids[3]][0] + 'N'] + rows[ids[3]][1:])
+            del rows[ids[2]]
+            write_rows(changed, [header] + rows)
+            expected = run_main(stdin=changed)
+            self.assertEqual(run_main('--previous', previous, '--delta', delta, stdin=changed), expected)
+            changes = collections.Counter(row[0] for row in read_rows(delta)[1:])
+            self.assertEqual(changes, {'changed': 2, 'new': 1, 'removed': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import collections
+import copy
+import os
+import random
+import unittest
+import methods
+import reader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS, TYPE_DICT = reader.get_data_settings(os.path.join(ROOT, 'config', 'settings.config'))
+# Each key's values cover the branches of the a, r and w fallbacks, including unknown and invalid values
+SURVEY_VALUES = {'mass_limit': [None, 50.0, 120.0], 'length_limit': [None, 20.0, 60.0],
+                 'avc': [None, 1, 3, 10, 12, 15], 'iri': [None, 1.5, 12.0], 'hati': [None, 2.0, 8.0],
+                 'vcg': [None, 0, 3, 5, 7], 'road_cat': [None, 'R1', 'r2', 'R3', 'r4', 'R5', 'r0', 'R9'],
+                 'seal_flag': ['Sealed', 'Unsealed', 'sealed', 'Other'], 'line_mark': ['Yes', 'No', 'yes'],
+                 'lane_width': [None, 3.4, 7.0], 'seal_shld': [None, 0.0, 1.5], 'seal_width': [None, 4.0, 14.0],
+                 'form_width': [None, 4.0, 14.0]}
+
+
+def make_surveys(count, seed=0):
+    rng = random.Random(seed)
+    return [{key: rng.choice(values) for key, values in SURVEY_VALUES.items()} for n in range(count)]
+
+
+def run(method_logic, surveys):
+    # Each survey's results, or the type of the exception it failed with
+    outcomes = []
+    for row_id, survey in enumerate(surveys):
+        try:
+            outcomes.append(method_logic(copy.copy(survey), row_id)[0])
+        except Exception as error:
+            outcomes.append(type(error))
+    return outcomes
+
+
+class CalculationPlanTest(unittest.TestCase):
+    def test_plan_matches_method_logic(self):
+        surveys = make_surveys(3000)
+        defaults = [SETTINGS['default_values'], dict(SETTINGS['default_values'], default_avc=0.3, default_r_val=0.4)]
+        for default_values in defaults:
+            for a_method in ('limits', 'avc', 'invalid'):
+                for r_method in ('iri', 'hati', 'invalid'):
+                    with self.subTest(a_method=a_method, r_method=r_method):
+                        hvir_params = {'a_method': a_method, 'r_method': r_method,
+                                       'data_params': {'default_values': default_values}}
+                        calculator, plan_calculator = methods.hvirCalculator(), methods.hvirCalculator()
+                        calculator.count_paths(collections.Counter())
+                        plan_calculator.count_paths(collections.Counter())
+                        plan = plan_calculator.compile(hvir_params)
+                        expected = run(lambda survey, row_id: calculator.method_logic(survey, hvir_params, row_id),
+                                       surveys)
+                        self.assertEqual(run(plan.method_logic, surveys), expected)
+                        self.assertEqual(plan_calculator.paths, calculator.paths)
+                        self.assertEqual(plan_calculator.diagnostics.summary(), calculator.diagnostics.summary())
+
+    def test_invalid_r_method_fails_rows(self):
+        default_values = dict(SETTINGS['default_values'], default_avc=0.3)
+        hvir_params = {'a_method': 'limits', 'r_method': 'invalid', 'data_params': {'default_values': default_values}}
+        survey = dict(make_surveys(1)[0], seal_flag='Sealed', mass_limit=None, avc=None)
+        calculator = methods.hvirCalculator()
+        calculator.count_paths(collections.Counter())
+        with self.assertRaises(ValueError):
+            calculator.compile(hvir_params).method_logic(survey)
+        # The paths taken before the row failed are counted
+        self.assertEqual(calculator.paths, collections.Counter(['a_default']))
+
+
+
+class BatchTest(unittest.TestCase):
+    def test_batch_matches_method_logic(self):
+        surveys = make_surveys(3000, seed=1)
+        columns = methods.columns_from_surveys(surveys)
+        for a_method in ('limits', 'avc', 'invalid'):
+            for r_method in ('iri', 'hati', 'invalid'):
+                with self.subTest(a_method=a_method, r_method=r_method):
+                    default_values = dict(SETTINGS['default_values'], default_avc=0.3, default_r_val=0.4)
+                    hvir_params = {'a_method': a_method, 'r_method': r_method,
+                                   'data_params': {'default_values': default_values}}
+                    calculator = methods.hvirCalculator()
+                    results = calculator.method_logic_batch(columns, hvir_params)
+                    outcomes = run(lambda survey, row_id: calculator.method_logic(survey, hvir_params, row_id),
+                                   surveys)
+                    for row_id, outcome in enumerate(outcomes):
+                        self.assertEqual(results['failed'][row_id], not isinstance(outcome, dict))
+                        if isinstance(outcome, dict):
+                            for key in ('a', 'r', 'w', 'minev', 'maxev'):
+                                value = results[key][row_id]
+                                self.assertTrue(value == outcome[key] or outcome[key] == 'NA' and value != value)
+                            self.assertEqual(results['cat'][row_id], outcome['cat'])
+
+
+if __name__ == '__main__':
+    unittest.main()
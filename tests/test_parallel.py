@@ -0,0 +1,26 @@
+import os
+import tempfile
+import unittest
+from helpers import REGISTER, run_main
+
+
+class ParallelTest(unittest.TestCase):
+    def test_jobs_match_stream(self):
+        expected = run_main('-s', stdin=REGISTER)
+        self.assertGreater(len(expected.splitlines()), 1)
+        self.assertEqual(run_main('-j', '2', stdin=REGISTER), expected)
+
+    def test_rollup_merges_across_workers(self):
+        # The register's byte ranges split some sections between workers
+        with tempfile.TemporaryDirectory() as directory:
+            serial, parallel = os.path.join(directory, 'serial.csv'), os.path.join(directory, 'parallel.csv')
+            run_main('--rollup', serial, stdin=REGISTER)
+            run_main('-j', '2', '--rollup', parallel, stdin=REGISTER)
+            with open(serial) as serial_file, open(parallel) as parallel_file:
+                expected = serial_file.read()
+                self.assertIn('\nsection,', expected)
+                self.assertEqual(parallel_file.read(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
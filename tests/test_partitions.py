@@ -0,0 +1,28 @@
+import csv
+import io
+import os
+import tempfile
+import unittest
+import partitions
+from helpers import REGISTER, run_main
+
+
+class PartitionsTest(unittest.TestCase):
+    def test_files_match_output(self):
+        header, *rows = list(csv.reader(io.StringIO(run_main(stdin=REGISTER))))
+        owner = header.index('owner')
+        for args in ((), ('-s', '--writers', '3', '--max-open', '3')):
+            with self.subTest(args=args), tempfile.TemporaryDirectory() as directory:
+                run_main('--partition', 'owner', '--partition-dir', directory, *args, stdin=REGISTER)
+                owners = sorted({row[owner] for row in rows})
+                self.assertEqual(sorted(os.listdir(directory)),
+                                 sorted(partitions.partition_name(value) + '.csv' for value in owners))
+                for value in owners:
+                    location = os.path.join(directory, partitions.partition_name(value) + '.csv')
+                    with open(location, newline='') as csv_file:
+                        self.assertEqual(list(csv.reader(csv_file)),
+                                         [header] + [row for row in rows if row[owner] == value])
+
+
+if __name__ == '__main__':
+    unittest.main()
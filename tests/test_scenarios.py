@@ -0,0 +1,13 @@
+import unittest
+from helpers import run_main
+
+
+class ScenariosTest(unittest.TestCase):
+    def test_compact_scenarios_match_dicts(self):
+        expected = run_main('--scenarios', 'all')
+        self.assertIn('cat_limits_iri', expected.splitlines()[0])
+        self.assertEqual(run_main('--compact', '--scenarios', 'all'), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
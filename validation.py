@@ -0,0 +1,154 @@
+import datetime
+import numpy as np
+
+SAMPLE_SIZE = 5
+CHUNK_ROWS = 4096
+NUMERIC_TYPES = ('int', 'float', 'bool')
+
+
+def _bound(value, datatype):
+    # 'None' is an open bound, datetime bounds are yyyymmdd or yyyy numbers
+    if value is None or value == 'None':
+        return None
+    if datatype == 'datetime':
+        text = str(value)
+        return datetime.datetime.strptime(text, '%Y%m%d' if len(text) == 8 else '%Y')
+    return float(value)
+
+
+def compile_rule(datatype, domain):
+    # Returns (description, check) for a column's domain, check(values) returns a bool array flagging the values
+    # outside it. Missing values are never flagged. Numeric values are checked as float arrays (NaN for missing),
+    # others by their distinct values. Range bounds may be given in either order, datetime domains are ranges
+    # whatever their range_type, with {dnow} always the upper bound (no dates in the future).
+    range_type, allowed = domain['range_type'], domain['range']
+    if range_type not in ('range', 'set') or allowed == 'None':
+        return None
+    if datatype == 'datetime':
+        bounds = [bound for bound in (_bound(value, datatype) for value in allowed if value != '{dnow}')
+                  if bound is not None]
+        low = min(bounds) if bounds else None
+        high = datetime.datetime.now() if '{dnow}' in allowed else (max(bounds) if len(bounds) > 1 else None)
+        return _describe(low, high), _value_check(
+            lambda value: (low is None or value >= low) and (high is None or value <= high))
+    if range_type == 'range':
+        low, high = _ordered([_bound(value, datatype) for value in allowed])
+        return _describe(low, high), _range_check(low, high)
+    if datatype in NUMERIC_TYPES:
+        return 'one of %s' % allowed, _numeric_set_check(np.array(sorted(float(value) for value in allowed)))
+    allowed = frozenset(allowed)
+    return 'one of %s' % sorted(allowed), _value_check(allowed.__contains__)
+
+
+def _describe(low, high):
+    low, high = [bound.date().isoformat() if isinstance(bound, datetime.datetime) else
+                 '%g' % bound if bound is not None else None for bound in (low, high)]
+    if low is None:
+        return 'at most %s' % high
+    if high is None:
+        return 'at least %s' % low
+    return 'between %s and %s' % (low, high)
+
+
+def _ordered(bounds):
+    if None in bounds:
+        return bounds[0], bounds[1]
+    return min(bounds), max(bounds)
+
+
+def _range_check(low, high):
+    def check(values):
+        values = np.asarray(values, dtype=float)
+        invalid = np.zeros(len(values), dtype=bool)
+        if low is not None:
+            invalid |= values < low
+        if high is not None:
+            invalid |= values > high
+        return invalid
+    return check
+
+
+def _numeric_set_check(allowed):
+    def check(values):
+        values = np.asarray(values, dtype=float)
+        return ~np.isin(values, allowed) & ~np.isnan(values)
+    return check
+
+
+def _value_check(is_valid):
+    # Each distinct value is checked once, most batches have none outside the domain and skip building the mask
+    def check(values):
+        if isinstance(values, np.ndarray):
+            values = values.tolist()
+        invalid = {value for value in set(values) if value is not None and not is_valid(value)}
+        if not invalid:
+            return np.zeros(len(values), dtype=bool)
+        return np.fromiter(map(invalid.__contains__, values), dtype=bool, count=len(values))
+    return check
+
+
+def compile_rules(settings, header):
+    # {column: (description, check)} for the header columns with a domain in settings
+    rules = {}
+    for name in header:
+        datatype = settings['datatypes'][name]
+        rule = compile_rule(datatype['type'], datatype['domain']) if 'domain' in datatype else None
+        if rule is not None:
+            rules[name] = rule
+    return rules
+
+
+class Validator:
+    # Checks batches of columns against the config domains, counting the values outside them per column and
+    # keeping the first sample_size unique_ids (row numbers without a unique_id column) of each
+    def __init__(self, settings, header, sample_size=SAMPLE_SIZE):
+        self.rules = compile_rules(settings, header)
+        self.sample_size = sample_size
+        self.id_key = 'unique_id' if 'unique_id' in header else None
+        self.counts = dict.fromkeys(self.rules, 0)
+        self.samples = {name: [] for name in self.rules}
+        self.row_count = 0
+        # Filled by a data_processor.compile_decoder(..., collect=validator) decoder, numeric columns row by row
+        # into numbers and the others as a tuple per row into objects. The caller adds the row numbers.
+        self.numeric_columns = [name for name in self.rules if settings['datatypes'][name]['type'] in NUMERIC_TYPES]
+        self.object_columns = [name for name in self.rules if name not in self.numeric_columns]
+        if self.id_key is not None and self.id_key not in self.rules:
+            self.object_columns.append(self.id_key)
+        self.numbers = []
+        self.objects = []
+        self.row_nums = []
+
+    def check(self, columns, ids):
+        self.row_count += len(ids)
+        for name, (description, check) in self.rules.items():
+            if name not in columns:
+                continue
+            invalid = check(columns[name])
+            count = int(np.count_nonzero(invalid))
+            if count:
+                self.counts[name] += count
+                sample = self.samples[name]
+                for index in np.flatnonzero(invalid)[:self.sample_size - len(sample)].tolist():
+                    sample.append(ids[index])
+
+    def flush(self):
+        # Checks the collected rows column by column and empties them
+        n_rows = len(self.row_nums)
+        if n_rows:
+            numbers = np.frombuffer(b''.join(self.numbers)).reshape(n_rows, len(self.numeric_columns))
+            columns = {name: numbers[:, index] for index, name in enumerate(self.numeric_columns)}
+            columns.update(zip(self.object_columns, zip(*self.objects)))
+            self.check(columns, columns[self.id_key] if self.id_key is not None else self.row_nums)
+        self.numbers.clear()
+        self.objects.clear()
+        self.row_nums.clear()
+
+    def summary(self):
+        return {name: {'count': count, 'rule': self.rules[name][0], 'unique_ids': self.samples[name]}
+                for name, count in self.counts.items() if count}
+
+
+def format_summary(summary):
+    return ['%s %s value(s) not %s (e.g. %s)' % (entry['count'], name, entry['rule'],
+                                                 ', '.join(str(row_id) for row_id in entry['unique_ids']))
+            for name, entry in summary.items()]
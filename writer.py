@@ -1,27 +1,115 @@
 import sys
 import csv
+import io
+import contextlib
+import datetime
+import compressed
 
+WRITE_CHUNK_ROWS = 4096
+# A streamed output starts with a chunk of this many rows, doubling up to WRITE_CHUNK_ROWS, so its first rows are
+# written without waiting for a full chunk to be calculated
+FIRST_STREAM_CHUNK_ROWS = 1
 
-def write_data(surveys, out_header, params):
+
+@contextlib.contextmanager
+def open_output(params):
+    # Yields (file, lineterminator) for the output: stdout when it is redirected, otherwise params['outfile'].
+    # Output is compressed with --compress, or for outfiles by their extension (e.g. results.csv.gz).
+    codec, level, buffer_size = compressed.params_options(params)
     if not sys.stdout.isatty():
-        # print('Writing to stdout')
-        writer = csv.DictWriter(sys.stdout, fieldnames=out_header, lineterminator='\n')
-        writer.writeheader()
-
-        for s in surveys:
-            ws = {}
-            for k in s.keys():
-                if k in out_header:
-                    ws[k] = s[k]
-            writer.writerow(ws)
+        if codec is None:
+            yield sys.stdout, '\n'
+        else:
+            sys.stdout.flush()
+            with compressed.wrap_text(sys.stdout.buffer, codec, 'w', level, buffer_size,
+                                      encoding=sys.stdout.encoding, newline='') as out_file:
+                yield out_file, '\n'
+            sys.stdout.buffer.flush()
     else:
-        # print('Writing to file')
-        with open(params['outfile'], mode='w', newline='') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=out_header)
-            writer.writeheader()
-            for s in surveys:
-                ws = {}
-                for k in s.keys():
-                    if k in out_header:
-                        ws[k] = s[k]
-                writer.writerow(ws)
+        with compressed.open_text(params['outfile'], 'w', codec, level, buffer_size, encoding=None,
+                                  newline='') as out_file:
+            yield out_file, '\r\n'
+
+
+def write_data(surveys, out_header, params, streamed=False):
+    # streamed when surveys are calculated as they are written
+    with open_output(params) as (out_file, lineterminator):
+        writer = csv.writer(out_file, lineterminator=lineterminator)
+        writer.writerow(out_header)
+        write_rows(writer, surveys, out_header, FIRST_STREAM_CHUNK_ROWS if streamed else WRITE_CHUNK_ROWS)
+
+
+def project(survey, out_header):
+    # The survey's out_header values as a row, '' for keys it does not have
+    return [survey.get(key, '') for key in out_header]
+
+
+def write_rows(writer, surveys, out_header, first_chunk_rows=WRITE_CHUNK_ROWS):
+    # Writes the surveys with a csv.writer, projected onto out_header and passed to writerows in chunks that
+    # double from first_chunk_rows up to WRITE_CHUNK_ROWS
+    rows = []
+    chunk_rows = first_chunk_rows
+    for survey in surveys:
+        rows.append(project(survey, out_header))
+        if len(rows) >= chunk_rows:
+            writer.writerows(rows)
+            rows = []
+            chunk_rows = min(2 * chunk_rows, WRITE_CHUNK_ROWS)
+    writer.writerows(rows)
+
+
+def write_lists(rows, out_header, params):
+    # write_data for rows that are already lists in out_header order
+    with open_output(params) as (out_file, lineterminator):
+        writer = csv.writer(out_file, lineterminator=lineterminator)
+        writer.writerow(out_header)
+        writer.writerows(rows)
+
+
+def write_rollup(location, rows, header):
+    with compressed.open_text(location, 'w', encoding=None, newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def get_lineterminator():
+    # Matches the line endings write_data uses for stdout and file output
+    return '\n' if not sys.stdout.isatty() else '\r\n'
+
+
+def format_rows(surveys, out_header, lineterminator):
+    # Formats surveys exactly as write_data would, for output assembled from separately processed chunks
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator=lineterminator)
+    write_rows(writer, surveys, out_header)
+    return buffer.getvalue()
+
+
+def write_chunks(chunks, out_header, params):
+    with open_output(params) as (out_file, lineterminator):
+        writer = csv.writer(out_file, lineterminator=lineterminator)
+        writer.writerow(out_header)
+        for chunk in chunks:
+            out_file.write(chunk)
+
+
+def write_log(logfile_location, key_fails, failed_rows, row_count, cache_info=None, notes=()):
+    with open(logfile_location, 'w') as logfile:
+        now = datetime.datetime.now()
+        logfile.writelines(['Completed: ' + now.strftime("%B %d, %Y") + '\n'])
+        logfile.writelines(['Total of %s rows were not completed' % len(failed_rows) + '\n'])
+        for key in key_fails.keys():
+            logfile.writelines([str(key_fails[key]) + ' ' + str(key) + ' key(s) could not be read' + '\n'])
+        logfile.writelines(['%s surveys read, %s surveys failed' % (row_count, len(failed_rows)) + '\n'])
+        if row_count > 0:
+            logfile.writelines(['%s percent success rate' % str(
+                round((row_count - len(failed_rows)) / row_count * 100, 2)) + '\n'])
+        if cache_info is not None:
+            logfile.writelines(['Result cache: %s hits, %s misses, %s percent hit rate, %s of %s entries used, '
+                                'about %s seconds saved' % (cache_info['hits'], cache_info['misses'],
+                                                            round(cache_info['hit_rate'] * 100, 2),
+                                                            cache_info['size'], cache_info['max_size'],
+                                                            round(cache_info['estimated_saved_seconds'], 3)) + '\n'])
+        for note in notes:
+            logfile.writelines([note + '\n'])